@@ -1,6 +1,12 @@
-import logging
+import hmac
+import time
+import atexit
+import signal
 import sys
+import logging
 import os
+import threading
+from functools import wraps, partial
 from datetime import timedelta, datetime, timezone
 
 from flask import (
@@ -9,9 +15,31 @@ from flask import (
     g, flash, render_template_string
 )
 
-from util.streaming import proxy_stream_request, extract_video_credentials
+from util.streaming import (
+    proxy_stream_request, extract_video_credentials, serve_archived_request, warm_stream_path, rewrite_cache_stats,
+    cloudfront_policy_expiry
+)
+from util.archive import ArchiveIndex
+from util.metrics import METRICS
+from util.diagnostics import DIAGNOSTICS, LIVE, TRACER, connection_pool_stats, process_stats
+from util.stream_cache import STREAM_CACHE
+from util.keyframes import KEYFRAMES
+from util.upstream import UPSTREAM
+from util.snapshot import SnapshotStore
+from util.page_cache import PageCache
+from util.qoe import QOE
+from util.profiler import PROFILER
+from util.http2 import enable_http2, mount_http2
+from util.scheduler import SCHEDULER
+from util.log_pipeline import configure_logging
+from util.scheduler import AdmissionRejected, PRIORITY_PLAYBACK, PRIORITY_PREFETCH
+from util.playlist import RenditionPolicy, parse_master_playlist, parse_media_playlist
 from util.utils import parse_user_agent, is_valid_email
 from fromm_api.FrommAPI import FrommAPI, ApiError
+from fromm_api import breaker_stats
+from fromm_api.http_client import stale_cache_stats, stale_cache_version, export_stale_cache, restore_stale_cache
+from fromm_api.token_refresh import TOKEN_REFRESHER
+from fromm_api.entitlements import ENTITLEMENTS, is_free_post
 
 # Configuration
 app = Flask(__name__)
@@ -22,26 +50,181 @@ CONTENT_HOST = "channel-contents.frommyarti.com"
 # Structure: { "tab_id_post_id": {creds_object} }
 VIDEO_CREDS_STORE = {}
 
+# VODs archived on local disk are replayed from here instead of the content host
+ARCHIVE = ArchiveIndex(os.environ.get('FROMM_ARCHIVE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), 'archive')))
+
+# Per-deployment rendition caps for the rewritten master playlist (users can only tighten them)
+DEFAULT_RENDITION_POLICY = RenditionPolicy.from_dict({
+    "max_bandwidth": os.environ.get('FROMM_MAX_BANDWIDTH'),
+    "max_resolution": os.environ.get('FROMM_MAX_RESOLUTION'),
+    "start_variant": os.environ.get('FROMM_START_VARIANT')
+})
+
+# Upstream segments served as one virtual segment in media playlists (1 = off)
+SEGMENT_GROUP = max(1, int(os.environ.get('FROMM_SEGMENT_GROUP', '1')))
+
+# List proxy-generated I-frame playlists (trick play) in master playlists. Off by default: only
+# native HLS players (Safari, AVPlayer) use them, hls.js does not, and indexing costs CPU per segment
+IFRAME_PLAYLISTS = os.environ.get('FROMM_IFRAME_PLAYLISTS', '0') == '1'
+
+# Renew sessions with the refresh token (POST /auth/refresh). Off by default: the endpoint is
+# assumed, not verified against the API; when off, an expired session logs the user out
+TOKEN_REFRESH = os.environ.get('FROMM_TOKEN_REFRESH', '0') == '1'
+
+# A token is refreshed in the background once less than this fraction of its lifetime (expiresIn) is left
+TOKEN_REFRESH_FRACTION = float(os.environ.get('FROMM_TOKEN_REFRESH_FRACTION', 0.15))
+
+METRICS.register_provider("api_breakers", breaker_stats)
+METRICS.register_provider("token_refresh", TOKEN_REFRESHER.stats)
+
+# Posts none of the user's tickets cover are left out of video listings instead of marked as locked
+HIDE_LOCKED_VIDEOS = os.environ.get('FROMM_HIDE_LOCKED_VIDEOS') == '1'
+
+# Archived posts opened through /api/post, remembered per session for stream_proxy
+ARCHIVED_POSTS_PER_SESSION = 32
+
+# Largest accepted playback quality beacon (bytes)
+QOE_MAX_BEACON_BYTES = 64 * 1024
+
+# Admin endpoints (/admin/...) need this token in the X-Admin-Token header, and are off without it
+ADMIN_TOKEN = os.environ.get('FROMM_ADMIN_TOKEN')
+
+# HTTP/2 to the content host and the Fromm APIs (optional dependency httpx[http2]),
+# FROMM_HTTP2_CONNECTIONS connections per host, each multiplexing many requests
+if os.environ.get('FROMM_HTTP2') == '1' and enable_http2(int(os.environ.get('FROMM_HTTP2_CONNECTIONS', 4))):
+    mount_http2(UPSTREAM.session)
+
+# Rendered /channels and /videos pages per user, revalidated by ETag.
+# The template files' mtimes version the fingerprints, so a deploy with new templates re-renders.
+PAGE_CACHE = PageCache(version=str(sorted(
+    (name, os.path.getmtime(os.path.join(app.root_path, 'templates', name)))
+    for name in os.listdir(os.path.join(app.root_path, 'templates'))
+)))
+
+# In-process stores reported by /admin/diagnostics
+DIAGNOSTICS.register_store("video_creds", VIDEO_CREDS_STORE)
+DIAGNOSTICS.register_store("stream_cache", STREAM_CACHE.stats)
+DIAGNOSTICS.register_store("keyframe_index", KEYFRAMES.stats)
+DIAGNOSTICS.register_store("archive_manifests", ARCHIVE.stats)
+DIAGNOSTICS.register_store("api_stale_cache", stale_cache_stats)
+DIAGNOSTICS.register_store("master_playlists", lambda: parse_master_playlist.cache_info()._asdict())
+DIAGNOSTICS.register_store("media_playlists", lambda: parse_media_playlist.cache_info()._asdict())
+DIAGNOSTICS.register_store("playlist_rewrites", rewrite_cache_stats)
+DIAGNOSTICS.register_store("scheduler", SCHEDULER.stats)
+DIAGNOSTICS.register_store("token_refresh", TOKEN_REFRESHER.stats)
+DIAGNOSTICS.register_store("page_cache", PAGE_CACHE.stats)
+DIAGNOSTICS.register_store("entitlements", ENTITLEMENTS.stats)
+DIAGNOSTICS.register_store("qoe_series", QOE.size)
+DIAGNOSTICS.register_store("jinja_templates", lambda: {
+    "entries": len(app.jinja_env.cache or ()),
+    "max_entries": getattr(app.jinja_env.cache, 'capacity', None)
+})
+
+# Caches are snapshotted to this file (periodically and at exit) and restored in the background
+# at startup; an empty FROMM_SNAPSHOT_FILE disables it
+SNAPSHOTS = SnapshotStore(os.environ.get(
+    'FROMM_SNAPSHOT_FILE',
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), 'snapshot.bin')
+))
+SNAPSHOT_INTERVAL = int(os.environ.get('FROMM_SNAPSHOT_INTERVAL', 300))
+
+# Credentials are only restored if their CloudFront policy is valid for at least this long (seconds)
+CREDS_MIN_VALIDITY = 60
+
+
+def export_video_creds():
+    for storage_key, creds in list(VIDEO_CREDS_STORE.items()):
+        expires_at = cloudfront_policy_expiry(creds.get('policy', ''))
+        if expires_at is not None and expires_at > time.time() + CREDS_MIN_VALIDITY:
+            yield {"key": storage_key, "creds": creds, "expires_at": expires_at}, b""
+
+
+def video_creds_version():
+    # Credentials are replaced, never mutated: the policies identify the store's content
+    return tuple((storage_key, creds.get('policy')) for storage_key, creds in list(VIDEO_CREDS_STORE.items()))
+
+
+def restore_video_creds(meta, body, created_at):
+    if meta["expires_at"] is None or meta["expires_at"] < time.time() + CREDS_MIN_VALIDITY:
+        return False
+    return VIDEO_CREDS_STORE.setdefault(meta["key"], meta["creds"]) is meta["creds"]
+
+
+SNAPSHOTS.register("video_creds", export_video_creds, restore_video_creds, video_creds_version)
+SNAPSHOTS.register("stream_cache", STREAM_CACHE.export, STREAM_CACHE.restore, STREAM_CACHE.version)
+SNAPSHOTS.register("api_stale_cache", export_stale_cache, restore_stale_cache, stale_cache_version)
+
 # Logger Configuration
+# Everything goes through a queue drained by a background thread, see util/log_pipeline.py
+configure_logging(logging.INFO)
 log = app.logger
 log.setLevel(logging.INFO)
-if not log.handlers:
-    stream_handler = logging.StreamHandler(sys.stdout)
-    stream_handler.setLevel(logging.INFO)
-    log.addHandler(stream_handler)
+
+# After configure_logging, so the exit snapshot is written before the log writer stops
+SNAPSHOTS.load_in_background()
+SNAPSHOTS.save_every(SNAPSHOT_INTERVAL)
+atexit.register(SNAPSHOTS.save)
+
+
+@app.before_request
+def tag_profiler_thread():
+    # Registered first, so the other before_request hooks are attributed to the endpoint too.
+    # The tag outlives the view: streamed bodies are relayed on this thread until the response is closed.
+    PROFILER.tag_thread(request.endpoint or "unmatched")
+
+
+@app.after_request
+def untag_profiler_thread(resp):
+    resp.call_on_close(partial(PROFILER.untag_thread, threading.get_ident()))
+    return resp
+
+
+@app.teardown_request
+def untag_failed_request(exc):
+    if exc is not None:
+        PROFILER.untag_thread()
 
 
 @app.before_request
 def load_api_from_session():
     data = session.get('fromm_api_data')
     g.api = FrommAPI.from_session_data(data)
+    if not g.api.access_token:
+        return
+
+    # pick up a refresh that finished in the background
+    refreshed = TOKEN_REFRESHER.collect(g.api.access_token) if TOKEN_REFRESH else None
+    if refreshed and refreshed.get('access_token') != g.api.access_token:
+        use_refreshed_session(refreshed)
+        return
+
     # check expired tokens
-    if g.api.access_token and g.api.is_token_expired():
+    if g.api.is_token_expired():
+        refreshed = TOKEN_REFRESHER.refresh_now(data) if TOKEN_REFRESH else None
+        if refreshed:
+            use_refreshed_session(refreshed)
+            return
         log.info("Session expired. Logging out user.")
         g.api.signout()
         session.pop('fromm_api_data', None)
+        session.pop('archived_posts', None)
         if request.endpoint and 'static' not in request.endpoint and 'login' not in request.endpoint:
             flash("Your session has expired. Please login again.", "warning")
+    elif TOKEN_REFRESH and g.api.refresh_due(TOKEN_REFRESH_FRACTION):
+        TOKEN_REFRESHER.schedule(data)
+
+
+def use_refreshed_session(data):
+    g.api = FrommAPI.from_session_data(data)
+    save_api_to_session()
+    g.token_refreshed = True
+
+
+@app.after_request
+def update_token_cookie(resp):
+    if g.get('token_refreshed') and g.api.access_token:
+        resp.set_cookie('accessToken', g.api.access_token)
+    return resp
 
 
 def save_api_to_session():
@@ -84,16 +267,6 @@ def login_page():
             flash("Invalid email format provided.", "danger")
             return render_template('login.html', error="Invalid email format.")
 
-        try:
-            if not g.api.account.check_user_exists(email_input):
-                log.warning(f"User not found: {email_input}")
-                flash("Account not found.", "danger")
-                return render_template('login.html', error="Account not found.")
-        except Exception as e:
-            log.error(f"API check failed: {e}")
-            flash("Unable to verify account existence.", "danger")
-            return render_template('login.html')
-
         try:
             if g.api.signin(email_input, password_input, device_id_input, user_agent_input, parsed_device_info):
                 log.info(f"Login successful: {email_input}")
@@ -103,13 +276,22 @@ def login_page():
                 resp = make_response(redirect(url_for('channels_page')))
                 resp.set_cookie('accessToken', g.api.access_token)
                 return resp
-            else:
-                log.warning("Login failed: Invalid credentials")
-                flash("Login failed. Invalid credentials.", "danger")
         except Exception as e:
             log.error(f"Login exception: {e}")
             flash(f"An error occurred: {e}", "danger")
+            return render_template('login.html', error="Invalid username or password.")
+
+        # Only a failed signin needs the existence check, to tell the two failures apart
+        try:
+            if not g.api.account.check_user_exists(email_input):
+                log.warning(f"User not found: {email_input}")
+                flash("Account not found.", "danger")
+                return render_template('login.html', error="Account not found.")
+        except Exception as e:
+            log.error(f"API check failed: {e}")
 
+        log.warning("Login failed: Invalid credentials")
+        flash("Login failed. Invalid credentials.", "danger")
         return render_template('login.html', error="Invalid username or password.")
 
     return render_template('login.html')
@@ -117,14 +299,73 @@ def login_page():
 
 @app.route('/logout')
 def logout_page():
+    ENTITLEMENTS.forget(g.api.access_token)
     g.api.signout()
     session.pop('fromm_api_data', None)
+    session.pop('archived_posts', None)
     flash("You have been logged out.", "info")
     resp = make_response(redirect(url_for('login_page')))
     resp.delete_cookie('accessToken')
     return resp
 
 
+def render_cached_page(route_key, template_name, **context):
+    """
+    Renders a page through PAGE_CACHE with a strong ETag fingerprinting its data.
+    A browser that already has this version gets a 304 without any rendering.
+
+    Args:
+        route_key (str): Identifies the page within the user's entries.
+        template_name (str): The template to render.
+        **context: The template variables, all of the page's data.
+
+    Returns:
+        flask.Response: The page, or an empty 304.
+    """
+    # The layout also reads the last visited channel from the session
+    fingerprint = PAGE_CACHE.fingerprint(template_name, context, session.get('last_channel_id'))
+    if request.if_none_match.contains(fingerprint):
+        METRICS.incr("page_cache.not_modified")
+        resp = make_response('', 304)
+    else:
+        resp = make_response(PAGE_CACHE.get_or_render(
+            g.api.access_token, route_key, fingerprint,
+            lambda: render_template(template_name, **context)
+        ))
+    resp.set_etag(fingerprint)
+    resp.headers['Cache-Control'] = 'private, no-cache'
+    return resp
+
+
+def list_live_records(raw_posts, channel_id):
+    """
+    Keeps the visible VODs of a page of posts, marking those none of the user's tickets cover.
+
+    Args:
+        raw_posts (list): Posts from ChannelAPI.get_posts.
+        channel_id (str): The channel they belong to.
+
+    Returns:
+        list: (post_id, video_data) pairs, newest first.
+    """
+    entitlements = ENTITLEMENTS.get(g.api)
+    videos_live = {}
+    for p in raw_posts:
+        if p.get("type") == "live_record" and p.get('isVisible'):
+            # Unknown entitlements (lookup failed) lock nothing, free posts are never locked
+            locked = (entitlements is not None and not is_free_post(p)
+                      and not entitlements.allows(channel_id, p["id"]))
+            if locked and HIDE_LOCKED_VIDEOS:
+                continue
+            videos_live[p["id"]] = {
+                "title": p["title"],
+                "displayStartAt": p["displayStartAt"],
+                "thumbnail": p["thumbnail"],
+                "locked": locked
+            }
+    return sorted(videos_live.items(), key=lambda item: item[1]['displayStartAt'], reverse=True)
+
+
 @app.route('/channels')
 def channels_page():
     if not g.api.access_token:
@@ -135,6 +376,7 @@ def channels_page():
         channel_response = g.api.channel.get_channels()
         if channel_response.get('success'):
             channel_list = channel_response.get('data', {}).get("channels", [])
+            return render_cached_page('channels', 'channels.html', channels=channel_list, active_page='channels')
         else:
             log.warning(f"Channel fetch failed: {channel_response}")
             flash("Could not fetch channels from API.", "warning")
@@ -152,9 +394,10 @@ def videos_page(channel_id):
 
     session['last_channel_id'] = channel_id
 
-    videos_live = {}
+    videos_list = []
     is_last = True
     raw_last_post = {}
+    fetched = False
 
     try:
         posts_response = g.api.channel.get_posts(channel_id=channel_id, limit=50)
@@ -166,13 +409,8 @@ def videos_page(channel_id):
             if raw_posts:
                 raw_last_post = raw_posts[-1]
 
-            for p in raw_posts:
-                if p.get("type") == "live_record" and p.get('isVisible'):
-                    videos_live[p["id"]] = {
-                        "title": p["title"],
-                        "displayStartAt": p["displayStartAt"],
-                        "thumbnail": p["thumbnail"]
-                    }
+            videos_list = list_live_records(raw_posts, channel_id)
+            fetched = True
         else:
             log.warning(f"Post fetch failed: {posts_response}")
             flash("Could not fetch posts.", "warning")
@@ -180,16 +418,16 @@ def videos_page(channel_id):
         log.error(f"API error: {e}")
         flash(f"Error fetching channel: {e}", "danger")
 
-    videos_list = sorted(videos_live.items(), key=lambda item: item[1]['displayStartAt'], reverse=True)
-
-    return render_template(
-        'videos.html',
+    context = dict(
         channel_id=channel_id,
         videos=videos_list,
         active_page='videos',
         is_last=is_last,
         last_post=raw_last_post
     )
+    if fetched:
+        return render_cached_page(f"videos/{channel_id}", 'videos.html', **context)
+    return render_template('videos.html', **context)
 
 
 @app.route('/api/load-more-videos', methods=['POST'])
@@ -223,24 +461,16 @@ def load_more_videos():
             if raw_posts:
                 next_last_post = raw_posts[-1]
 
-            videos_live = {}
-            for p in raw_posts:
-                if p["type"] == "live_record" and p['isVisible']:
-                    videos_live[p["id"]] = {
-                        "title": p["title"],
-                        "displayStartAt": p["displayStartAt"],
-                        "thumbnail": p["thumbnail"]
-                    }
-
-            videos_list = sorted(videos_live.items(), key=lambda item: item[1]['displayStartAt'], reverse=True)
+            videos_list = list_live_records(raw_posts, channel_id)
 
             template_fragment = """
             {% for video_id, video_data in videos %}
-            <a href="{{ url_for('player_page', channel_id=channel_id, post_id=video_id) }}" class="block bg-gray-700 rounded-lg hover:bg-gray-600 transition-colors shadow overflow-hidden">
+            <a href="{{ url_for('player_page', channel_id=channel_id, post_id=video_id) }}" class="block bg-gray-700 rounded-lg hover:bg-gray-600 transition-colors shadow overflow-hidden{% if video_data.locked %} opacity-50{% endif %}">
                 <img src="{{ video_data.thumbnail.url }}" alt="Thumbnail for {{ video_data.title }}" class="w-full h-40 object-cover">
                 <div class="p-4">
                     <h2 class="font-semibold text-lg truncate" title="{{ video_data.title }}">{{ video_data.title }}</h2>
                     <p class="text-sm text-gray-400">{{ video_data.displayStartAt | kst_format }}</p>
+                    {% if video_data.locked %}<p class="text-sm text-yellow-400">No ticket for this video</p>{% endif %}
                 </div>
             </a>
             {% endfor %}
@@ -268,7 +498,7 @@ def player_page(channel_id, post_id):
     if not g.api.access_token:
         return redirect(url_for('login_page'))
 
-    log.info(f"Serving player: channel={channel_id}, post={post_id}")
+    log.info("Serving player: channel=%s, post=%s", channel_id, post_id)
     return render_template('player.html', channel_id=channel_id, post_id=post_id)
 
 
@@ -281,6 +511,24 @@ def get_post_info(channel_id, post_id):
     if not tab_id:
         return jsonify({"error": "Tab ID header missing"}), 400
 
+    if ARCHIVE.is_archived(post_id):
+        # Archived posts are served from disk: no upstream call, creds or warm-up. The content
+        # host is not there to check access, so the user's tickets are (when they are known)
+        entitlements = ENTITLEMENTS.get(g.api)
+        if entitlements is not None and not entitlements.allows(channel_id, post_id):
+            return jsonify({"error": "None of your tickets covers this post"}), 403
+        archived_posts = [p for p in session.get('archived_posts', []) if p != post_id]
+        session['archived_posts'] = archived_posts[-(ARCHIVED_POSTS_PER_SESSION - 1):] + [post_id]
+        log.info("Post %s is archived locally, skipping upstream", post_id)
+        archived_post = ARCHIVE.get_post_data(post_id)
+        if archived_post:
+            return jsonify(archived_post)
+        # Built by rebuild_manifest, without post data: point the player at the archived playlist
+        entry_playlist = ARCHIVE.entry_playlist(post_id)
+        if not entry_playlist:
+            return jsonify({"error": "Archived post has no playlist"}), 404
+        return jsonify({"url": f"https://{CONTENT_HOST}/{entry_playlist}"})
+
     try:
         videos_info = g.api.channel.get_post(channel_id=channel_id, post_id=post_id)
         if not videos_info.get('success'):
@@ -296,7 +544,18 @@ def get_post_info(channel_id, post_id):
         VIDEO_CREDS_STORE[storage_key] = video_data['creds']
         if 'master_url' in video_data['post_data']:
             video_data['post_data']['url'] = video_data['post_data']['master_url']
-            log.info("Master playlist used to stream")
+            log.debug("Master playlist used to stream")
+
+        # Fetch the first playlists and segments while the player boots
+        warm_stream_path(
+            post_id,
+            video_data['post_data']['url'],
+            cloudfront_cookies(video_data['creds']),
+            CONTENT_HOST,
+            user_agent_string=g.api.user_agent_string,
+            device_info=g.api.device_info,
+            rendition_policy=current_rendition_policy()
+        )
         return jsonify(video_data['post_data'])
 
     except ApiError as e:
@@ -307,8 +566,45 @@ def get_post_info(channel_id, post_id):
         return jsonify({"error": str(e)}), 500
 
 
+def cloudfront_cookies(stream_creds):
+    return {
+        "CloudFront-Key-Pair-Id": stream_creds['publicKey'],
+        "CloudFront-Signature": stream_creds['signature'],
+        "CloudFront-Policy": stream_creds['policy']
+    }
+
+
+def current_rendition_policy():
+    return DEFAULT_RENDITION_POLICY.merge(RenditionPolicy.from_dict(session.get('rendition_policy')))
+
+
+@app.route('/api/rendition-policy', methods=['GET', 'POST'])
+def rendition_policy():
+    if not g.api.access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+
+    if request.method == 'POST':
+        user_policy = RenditionPolicy.from_dict(request.get_json(silent=True))
+        session['rendition_policy'] = user_policy._asdict()
+
+    return jsonify(current_rendition_policy()._asdict())
+
+
+def stream_priority(req):
+    """Speculative loads (browser or player prefetch hints) yield to what a player needs now."""
+    purpose = req.headers.get('Sec-Purpose') or req.headers.get('Purpose') or req.headers.get('X-Purpose') or ''
+    if 'prefetch' in purpose.lower():
+        return PRIORITY_PREFETCH
+    return PRIORITY_PLAYBACK
+
+
 @app.route('/stream/p<int:post_id>/<path:video_path>')
 def stream_proxy(post_id, video_path):
+    if g.api.access_token and post_id in session.get('archived_posts', ()) and ARCHIVE.is_archived(post_id):
+        archived_response = serve_archived_request(post_id, video_path, ARCHIVE, current_rendition_policy())
+        if archived_response is not None:
+            return archived_response
+
     tab_id = request.args.get('tid')
 
     if not tab_id:
@@ -324,27 +620,151 @@ def stream_proxy(post_id, video_path):
         return "Streaming credentials expired or missing. Please refresh.", 401
 
     try:
-        mapped_creds = {
-            "CloudFront-Key-Pair-Id": stream_creds['publicKey'],
-            "CloudFront-Signature": stream_creds['signature'],
-            "CloudFront-Policy": stream_creds['policy']
-        }
+        mapped_creds = cloudfront_cookies(stream_creds)
         return proxy_stream_request(
             post_id,
             video_path,
             mapped_creds,
             CONTENT_HOST,
             user_agent_string=g.api.user_agent_string,
-            device_info=g.api.device_info
+            device_info=g.api.device_info,
+            tab_id=tab_id,
+            user_id=g.api.device_id,
+            priority=stream_priority(request),
+            rendition_policy=current_rendition_policy(),
+            segment_group=SEGMENT_GROUP,
+            iframe_playlists=IFRAME_PLAYLISTS,
+            byte_range=request.headers.get('Range')
         )
+    except AdmissionRejected as e:
+        log.warning("Stream proxy busy: %s", e)
+        return "Too many concurrent streams, retry shortly.", 503, {"Retry-After": "2"}
     except KeyError as e:
-        log.error(f"Stream proxy creds error: {e}")
+        log.error("Stream proxy creds error: %s", e)
         return "Invalid streaming credentials format.", 500
     except Exception as e:
-        log.error(f"Stream proxy error: {e}")
+        log.error("Stream proxy error: %s", e)
         return f"Error proxying request: {e}", 500
 
 
+def admin_required(view):
+    @wraps(view)
+    def wrapper(*args, **kwargs):
+        if not ADMIN_TOKEN:
+            return "Not Found", 404
+        if not hmac.compare_digest(request.headers.get('X-Admin-Token', ''), ADMIN_TOKEN):
+            return jsonify({"error": "Forbidden"}), 403
+        return view(*args, **kwargs)
+    return wrapper
+
+
+@app.route('/api/metrics')
+@admin_required
+def metrics():
+    return jsonify(METRICS.snapshot())
+
+
+@app.route('/api/metrics/qoe')
+@admin_required
+def qoe_metrics():
+    return jsonify(QOE.post_stats())
+
+
+@app.route('/api/qoe', methods=['POST'])
+def qoe_beacon():
+    """Playback quality beacons from the player: {"p": post_id, "e": [[code, rendition, value], ...]}."""
+    if not g.api.access_token:
+        return jsonify({"error": "Not authenticated"}), 401
+    if (request.content_length or 0) > QOE_MAX_BEACON_BYTES:
+        return jsonify({"error": "Beacon too large"}), 413
+
+    # sendBeacon posts text/plain, so the content type is not checked
+    beacon = request.get_json(force=True, silent=True)
+    if not isinstance(beacon, dict) or not isinstance(beacon.get('e'), list):
+        return jsonify({"error": "Malformed beacon"}), 400
+    try:
+        post_id = int(beacon.get('p'))
+    except (TypeError, ValueError):
+        return jsonify({"error": "Malformed beacon"}), 400
+
+    QOE.ingest(post_id, beacon['e'])
+    return '', 204
+
+
+@app.route('/stream-sw.js')
+def stream_service_worker():
+    # Served from the root so it may control the player pages, which are outside /stream/
+    resp = make_response(send_from_directory(
+        os.path.join(app.root_path, 'static'),
+        'stream-sw.js',
+        mimetype='text/javascript'
+    ))
+    resp.headers['Cache-Control'] = 'no-cache'
+    return resp
+
+
+@app.route('/admin/diagnostics')
+@admin_required
+def admin_diagnostics():
+    return jsonify({
+        "process": process_stats(),
+        "stores": DIAGNOSTICS.stores(),
+        "connections": {
+            "upstream": connection_pool_stats([UPSTREAM.session]),
+            "api": connection_pool_stats(LIVE.objects("api_sessions")),
+        },
+        "objects": LIVE.stats(),
+        "tracemalloc": TRACER.tracing,
+        "profiler": PROFILER.running,
+    })
+
+
+@app.route('/admin/diagnostics/tracemalloc', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def admin_tracemalloc():
+    """
+    POST starts tracing and takes the baseline (again), GET returns the growth since
+    the baseline grouped by module (?limit=N, ?reset=1 to move the baseline), DELETE stops tracing.
+    """
+    if request.method == 'POST':
+        TRACER.start(frames=request.args.get('frames', 1, type=int))
+        return jsonify({"tracing": True})
+    if request.method == 'DELETE':
+        TRACER.stop()
+        return jsonify({"tracing": False})
+
+    diff = TRACER.diff(limit=request.args.get('limit', 30, type=int), reset=request.args.get('reset') == '1')
+    if diff is None:
+        return jsonify({"error": "tracemalloc is not started, POST to this endpoint first"}), 409
+    return jsonify(diff)
+
+
+@app.route('/admin/profiler', methods=['GET', 'POST', 'DELETE'])
+@admin_required
+def admin_profiler():
+    """
+    POST starts sampling every thread's stack (?seconds=30, ?interval_ms=10), DELETE stops early,
+    GET returns the run's progress and samples per endpoint.
+    """
+    if request.method == 'POST':
+        if not PROFILER.start(duration=request.args.get('seconds', 30, type=float),
+                              interval=request.args.get('interval_ms', 10, type=float) / 1000):
+            return jsonify({"error": "A profile is already running, DELETE it first"}), 409
+        return jsonify(PROFILER.stats())
+    if request.method == 'DELETE':
+        PROFILER.stop()
+    return jsonify(PROFILER.stats())
+
+
+@app.route('/admin/profiler/collapsed')
+@admin_required
+def admin_profiler_collapsed():
+    """The last run as collapsed stacks for flamegraph.pl or speedscope (?endpoint= keeps one root)."""
+    resp = make_response(PROFILER.collapsed(endpoint=request.args.get('endpoint')))
+    resp.mimetype = 'text/plain'
+    return resp
+
+
 @app.route('/favicon.ico')
 def favicon():
     return send_from_directory(
@@ -355,4 +775,6 @@ def favicon():
 
 
 if __name__ == '__main__':
+    # Exit through atexit on SIGTERM too, so the cache snapshot is written
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(0))
     app.run(debug=False, port=5000, threaded=True)
\ No newline at end of file
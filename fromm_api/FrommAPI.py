@@ -33,6 +33,7 @@ class FrommAPI:
         self.refresh_token = None
         self.resource_token = None
         self.token_expiry = None
+        self.token_lifetime = None  # expiresIn of the last signin or refresh, in seconds
 
         self.profile = None  # To store user profile data
         self.user_agent_string = None
@@ -72,39 +73,12 @@ class FrommAPI:
 
             if access_token:
                 log.info("Sign-in successful. Storing tokens.")
-                # Store all auth-related state
-                self.access_token = access_token
-                self.refresh_token = response.get('data', {}).get('refreshToken')
-                self.resource_token = response.get('data', {}).get('resourceToken')
                 self.user_agent_string = user_agent_string
                 self.device_info = device_info
+                self._store_tokens(response.get('data', {}), access_token)
 
-                expires_in_seconds = response.get('data', {}).get('expiresIn', 0)
-
-                # 2. Calculate absolute timestamp (Now + Seconds)
-                if expires_in_seconds:
-                    current_time = datetime.now(timezone.utc).timestamp()
-                    self.token_expiry = current_time + expires_in_seconds
-                else:
-                    self.token_expiry = None
-
-
-                # Propagate the new token to the other API clients
-                #TODO wrap everything in a single class
-                self.channel.set_token(self.access_token)
-                self.user.set_token(self.access_token)
-                self.channel.set_user_agent_string(self.user_agent_string)
-                self.user.set_user_agent_string(self.user_agent_string)
-                self.channel.set_device_info(self.device_info)
-                self.user.set_device_info(self.device_info)
-
-                # Fetch and store profile
-                profile_response = self.user.get_profile()
-                if profile_response.get('success'):
-                    self.profile = profile_response.get('data')
-                else:
-                    log.warning(f"Could not fetch profile: {profile_response}")
-                    self.profile = None  # Ensure profile is None on failure
+                # The profile is not fetched on the login path: nothing reads it
+                self.profile = None
 
                 return True
         except ApiError as e:
@@ -114,6 +88,57 @@ class FrommAPI:
 
         return False
 
+    def refresh(self):
+        """
+        Gets a new access token with the stored refresh token, without the
+        existence check and signin round trips.
+
+        Returns:
+            bool: True on success, False on failure (the current tokens are kept).
+        """
+        if not self.refresh_token:
+            return False
+        try:
+            response, access_token = self.account.refresh(self.refresh_token, self.device_id)
+        except ApiError as e:
+            log.warning("Token refresh failed: %s", e)
+            return False
+
+        if not access_token:
+            log.warning("Token refresh rejected: %s", response)
+            return False
+        log.info("Access token refreshed for device %s", self.device_id)
+        self._store_tokens(response.get('data', {}), access_token)
+        return True
+
+    def _store_tokens(self, data, access_token):
+        """
+        Stores the tokens of a signin or refresh response and propagates
+        the access token to the other API clients.
+        """
+        self.access_token = access_token
+        # A refresh response may not rotate these
+        self.refresh_token = data.get('refreshToken') or self.refresh_token
+        self.resource_token = data.get('resourceToken') or self.resource_token
+
+        expires_in_seconds = data.get('expiresIn', 0)
+        # Absolute timestamp (Now + Seconds)
+        if expires_in_seconds:
+            current_time = datetime.now(timezone.utc).timestamp()
+            self.token_expiry = current_time + expires_in_seconds
+            self.token_lifetime = expires_in_seconds
+        else:
+            self.token_expiry = None
+            self.token_lifetime = None
+
+        #TODO wrap everything in a single class
+        self.channel.set_token(self.access_token)
+        self.user.set_token(self.access_token)
+        self.channel.set_user_agent_string(self.user_agent_string)
+        self.user.set_user_agent_string(self.user_agent_string)
+        self.channel.set_device_info(self.device_info)
+        self.user.set_device_info(self.device_info)
+
     def signout(self):
         """
         Clears the internal authentication state.
@@ -123,6 +148,7 @@ class FrommAPI:
         self.refresh_token = None
         self.resource_token = None
         self.token_expiry = None
+        self.token_lifetime = None
         self.profile = None
         self.device_id = None
         self.user_agent_string = None
@@ -147,6 +173,7 @@ class FrommAPI:
             "refresh_token": self.refresh_token,
             "resource_token": self.resource_token,
             "token_expiry": self.token_expiry,
+            "token_lifetime": self.token_lifetime,
             "profile": self.profile,
             "user_agent_string": self.user_agent_string,
             "device_info": self.device_info
@@ -176,8 +203,10 @@ class FrommAPI:
         api.refresh_token = data.get("refresh_token")
         api.resource_token = data.get("resource_token")
         api.token_expiry = data.get("token_expiry")
+        api.token_lifetime = data.get("token_lifetime")
         api.user_agent_string = data.get("user_agent_string")
         api.device_info = data.get("device_info")
+        api.profile = data.get("profile")
 
 
         if api.access_token:
@@ -200,4 +229,14 @@ class FrommAPI:
 
         current_time = datetime.now(timezone.utc).timestamp()
         # Check if current time is PAST the stored expiry time
-        return current_time > self.token_expiry
\ No newline at end of file
+        return current_time > self.token_expiry
+
+    def refresh_due(self, fraction):
+        """
+        Returns True once less than `fraction` (0-1) of the token's lifetime is left.
+        False when the lifetime is unknown (sessions from before it was stored).
+        """
+        if not self.access_token or not self.token_expiry or not self.token_lifetime:
+            return False
+        current_time = datetime.now(timezone.utc).timestamp()
+        return self.token_expiry - current_time < fraction * self.token_lifetime
@@ -1,6 +1,7 @@
 from .api.account_api import AccountAPI
 from .api.channel_api import ChannelAPI
 from .api.user_api import UserAPI
-from .exceptions import ApiError
+from .exceptions import ApiError, CircuitOpenError
+from .circuit_breaker import breaker_stats
 
-__all__ = ["AccountAPI", "ChannelAPI", "UserAPI", "ApiError"]
\ No newline at end of file
+__all__ = ["AccountAPI", "ChannelAPI", "UserAPI", "ApiError", "CircuitOpenError", "breaker_stats"]
\ No newline at end of file
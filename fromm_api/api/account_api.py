@@ -53,4 +53,28 @@ class AccountAPI:
         if response.get("success"):
             access_token = response.get("data", {}).get("accessToken")
 
-        return response, access_token
\ No newline at end of file
+        return response, access_token
+
+    def refresh(self, refresh_token, device_id):
+        """
+        Exchanges a refresh token for a new access token.
+        POST /auth/refresh
+
+        Returns:
+            tuple: (full_api_response, access_token), same shape as signin()
+        """
+        headers = get_base_app_headers()
+        headers['uuid'] = device_id
+
+        payload = {
+            "refreshToken": refresh_token,
+            "deviceId": device_id
+        }
+
+        response = self.client.post("/auth/refresh", headers=headers, json=payload)
+
+        access_token = None
+        if response.get("success"):
+            access_token = response.get("data", {}).get("accessToken")
+
+        return response, access_token
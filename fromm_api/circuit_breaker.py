@@ -0,0 +1,113 @@
+import os
+import time
+import logging
+import threading
+from collections import deque
+
+log = logging.getLogger(__name__)
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """
+    Failure-rate circuit breaker for one upstream base URL.
+
+    closed    -> calls go through, outcomes are recorded in a rolling window
+    open      -> calls are refused until reset_timeout has elapsed
+    half_open -> a single probe call is let through; success closes the
+                 breaker, failure opens it again
+    """
+
+    def __init__(self, name, window=20, min_calls=5, failure_rate=0.5, reset_timeout=30.0):
+        self.name = name
+        self.window = window
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.reset_timeout = reset_timeout
+
+        self.state = CLOSED
+        self.opened_at = None
+        self._outcomes = deque(maxlen=window)  # True = failure
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+
+    def allow_request(self):
+        """Returns True if a call may be made now."""
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN:
+                if time.monotonic() - self.opened_at < self.reset_timeout:
+                    return False
+                self.state = HALF_OPEN
+                log.info("Circuit for %s half-open, probing", self.name)
+            # Half-open: only one probe at a time
+            if self._probe_in_flight:
+                return False
+            self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                log.info("Circuit for %s closed", self.name)
+                self.state = CLOSED
+                self._outcomes.clear()
+                self._probe_in_flight = False
+            self._outcomes.append(False)
+
+    def record_failure(self):
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._open()
+                return
+            self._outcomes.append(True)
+            calls = len(self._outcomes)
+            if self.state == CLOSED and calls >= self.min_calls:
+                if sum(self._outcomes) / calls >= self.failure_rate:
+                    self._open()
+
+    def _open(self):
+        log.warning("Circuit for %s opened", self.name)
+        self.state = OPEN
+        self.opened_at = time.monotonic()
+        self._probe_in_flight = False
+
+    def stats(self):
+        with self._lock:
+            return {
+                "state": self.state,
+                "calls": len(self._outcomes),
+                "failures": sum(self._outcomes),
+            }
+
+
+# One breaker per base URL, shared by every HttpClient talking to it
+_BREAKERS = {}
+_registry_lock = threading.Lock()
+
+# Settings for every breaker
+BREAKER_SETTINGS = {
+    "window": int(os.environ.get('FROMM_BREAKER_WINDOW', 20)),
+    "min_calls": int(os.environ.get('FROMM_BREAKER_MIN_CALLS', 5)),
+    "failure_rate": float(os.environ.get('FROMM_BREAKER_FAILURE_RATE', 0.5)),
+    "reset_timeout": float(os.environ.get('FROMM_BREAKER_RESET_TIMEOUT', 30)),
+}
+
+
+def get_breaker(base_url):
+    breaker = _BREAKERS.get(base_url)
+    if breaker is None:
+        with _registry_lock:
+            breaker = _BREAKERS.get(base_url)
+            if breaker is None:
+                breaker = CircuitBreaker(base_url, **BREAKER_SETTINGS)
+                _BREAKERS[base_url] = breaker
+    return breaker
+
+
+def breaker_stats():
+    return {name: breaker.stats() for name, breaker in list(_BREAKERS.items())}
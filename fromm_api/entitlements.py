@@ -0,0 +1,175 @@
+import os
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from util.metrics import METRICS
+from .exceptions import ApiError
+
+log = logging.getLogger(__name__)
+
+# Post fields telling that no ticket is needed: flags that are True on free posts,
+# flags that are False on them, and prices that are 0 on them
+FREE_FLAGS = ("isFree", "free")
+PAID_FLAGS = ("isPaid", "needTicket", "needsTicket", "isTicketRequired", "ticketRequired", "requireTicket")
+PRICE_FIELDS = ("price", "ticketPrice", "amount")
+
+
+def is_free_post(post):
+    """True if a post from ChannelAPI.get_posts says it can be watched without a ticket."""
+    if any(post.get(key) is True for key in FREE_FLAGS):
+        return True
+    if any(post.get(key) is False for key in PAID_FLAGS):
+        return True
+    return any(post.get(key) in (0, "0") and not isinstance(post.get(key), bool) for key in PRICE_FIELDS)
+
+
+class Entitlements:
+    """
+    The channels and posts a user's tickets give access to, as sets for
+    constant-time lookups while a listing is rendered.
+    """
+
+    def __init__(self, channel_ids=(), post_ids=()):
+        self.channel_ids = frozenset(str(channel_id) for channel_id in channel_ids)
+        self.post_ids = frozenset(str(post_id) for post_id in post_ids)
+
+    @classmethod
+    def from_response(cls, response):
+        """
+        Indexes a GET /v2/purchase/usingTicket/reader response.
+
+        Tickets are found anywhere in `data`, so nesting changes in the API do
+        not lose entitlements. Every object naming posts (`postId`, `postIds`,
+        `post.id`) grants those posts. An object naming a channel (`channelId`,
+        `channel.id`) grants the whole channel only if it is a channel ticket:
+        neither it, its contents nor an enclosing object name a post. A post
+        ticket carrying its channelId therefore grants only its post.
+        """
+        channel_ids, post_ids = set(), set()
+        if isinstance(response, dict):
+            _collect_tickets(response.get("data"), False, channel_ids, post_ids)
+        return cls(channel_ids, post_ids)
+
+    @property
+    def known(self):
+        """False if no id was found: the payload had another shape, nothing can be concluded."""
+        return bool(self.channel_ids or self.post_ids)
+
+    def allows(self, channel_id, post_id=None):
+        """True if a ticket covers the whole channel or this post."""
+        return str(channel_id) in self.channel_ids or (post_id is not None and str(post_id) in self.post_ids)
+
+
+def _post_refs(node):
+    post = node.get("post")
+    refs = [node.get("postId"), post.get("id") if isinstance(post, dict) else None]
+    refs.extend(node.get("postIds") or ())
+    return [value for value in refs if value is not None]
+
+
+def _collect_tickets(node, in_post_ticket, channel_ids, post_ids):
+    """
+    Adds the ids granted by node to the sets (see Entitlements.from_response).
+
+    Returns:
+        bool: True if node or its contents name a post.
+    """
+    if isinstance(node, list):
+        names_posts = False
+        for item in node:
+            names_posts |= _collect_tickets(item, in_post_ticket, channel_ids, post_ids)
+        return names_posts
+    if not isinstance(node, dict):
+        return False
+
+    own_posts = _post_refs(node)
+    post_ids.update(own_posts)
+    names_posts = bool(own_posts)
+    for value in node.values():
+        if isinstance(value, (dict, list)):
+            names_posts |= _collect_tickets(value, in_post_ticket or bool(own_posts), channel_ids, post_ids)
+
+    if not names_posts and not in_post_ticket:
+        channel = node.get("channel")
+        for value in (node.get("channelId"), channel.get("id") if isinstance(channel, dict) else None):
+            if value is not None:
+                channel_ids.add(value)
+    return names_posts
+
+
+class EntitlementCache:
+    """
+    Entitlements per login session (keyed by access token), fetched from
+    UserAPI.get_using_ticket at most once per `ttl` seconds.
+
+    A failed lookup is not cached and yields None, and a response in which no
+    ticket id was recognized yields None too: callers then show every post as
+    before rather than hiding content the user may have paid for.
+    """
+
+    def __init__(self, ttl=600, max_entries=1024):
+        """
+        Args:
+            ttl (int): Seconds before a user's tickets are fetched again.
+            max_entries (int): Sessions kept, least recently used evicted first.
+        """
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = OrderedDict()  # { access_token: (fetched_at, Entitlements) }
+        self._lock = threading.Lock()
+
+    def get(self, api):
+        """
+        Returns the Entitlements of the API client's session, or None if they are unknown.
+
+        Args:
+            api (FrommAPI): An authenticated client.
+        """
+        key = api.access_token
+        if not key:
+            return None
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and now - entry[0] < self.ttl:
+                self._entries.move_to_end(key)
+                METRICS.incr("entitlements.hits")
+                return entry[1]
+
+        METRICS.incr("entitlements.fetches")
+        try:
+            response = api.user.get_using_ticket()
+        except ApiError as e:
+            log.warning("Could not fetch tickets: %s", e)
+            return None
+        # HttpClient returns the raw text of non-JSON bodies
+        if not isinstance(response, dict) or not response.get("success"):
+            log.warning("Ticket fetch failed: %.200s", response)
+            return None
+
+        entitlements = Entitlements.from_response(response)
+        log.debug("Tickets cover %d channels and %d posts",
+                  len(entitlements.channel_ids), len(entitlements.post_ids))
+        if not entitlements.known:
+            METRICS.incr("entitlements.unrecognized")
+            entitlements = None
+        with self._lock:
+            self._entries[key] = (now, entitlements)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return entitlements
+
+    def forget(self, access_token):
+        with self._lock:
+            self._entries.pop(access_token, None)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "max_entries": self.max_entries, "ttl": self.ttl}
+
+
+# Tickets are looked up again after this many seconds (a purchase shows up within that delay)
+ENTITLEMENTS = EntitlementCache(ttl=int(os.environ.get('FROMM_ENTITLEMENT_TTL', 600)))
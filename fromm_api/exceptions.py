@@ -2,4 +2,12 @@ class ApiError(Exception):
     """
     Base exception for this API wrapper.
     """
+    pass
+
+
+class CircuitOpenError(ApiError):
+    """
+    Raised without calling the API when its circuit breaker is open
+    and no previous response can be served instead.
+    """
     pass
\ No newline at end of file
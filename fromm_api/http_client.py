@@ -1,18 +1,91 @@
+import os
+import json
+import time
 import requests
 import logging
-from .exceptions import ApiError
+import threading
+from collections import OrderedDict
+from util.diagnostics import LIVE
+from util.http2 import mount_http2
+from .exceptions import ApiError, CircuitOpenError
+from .circuit_breaker import get_breaker
 
-# Configure logging
-logging.basicConfig(level=logging.INFO)
 log = logging.getLogger(__name__)
 
+# (connect, read) timeout in seconds for every API call
+DEFAULT_TIMEOUT = (float(os.environ.get('FROMM_API_CONNECT_TIMEOUT', 3.05)),
+                   float(os.environ.get('FROMM_API_READ_TIMEOUT', 10)))
+
+# Last good GET responses, served while an API is unavailable.
+# Keyed per token so users never see each other's data.
+STALE_CACHE_SIZE = 512
+# Stale responses restored from a startup snapshot only if it is younger than this (seconds)
+STALE_SNAPSHOT_MAX_AGE = 24 * 3600
+_stale_cache = OrderedDict()
+_stale_lock = threading.Lock()
+_stale_generation = 0  # bumped when an entry is added or changes, see stale_cache_version
+
+
+def _stale_key(url, params, auth_token):
+    return url, tuple(sorted((params or {}).items())), auth_token
+
+
+def _remember_response(key, value):
+    global _stale_generation
+    with _stale_lock:
+        if _stale_cache.get(key) != value:
+            _stale_generation += 1
+        _stale_cache[key] = value
+        _stale_cache.move_to_end(key)
+        while len(_stale_cache) > STALE_CACHE_SIZE:
+            _stale_cache.popitem(last=False)
+
+
+def stale_cache_stats():
+    with _stale_lock:
+        return {"entries": len(_stale_cache), "max_entries": STALE_CACHE_SIZE}
+
+
+def stale_cache_version():
+    return _stale_generation
+
+
+def export_stale_cache():
+    """Yields (meta, body) snapshot records of the stale response cache."""
+    with _stale_lock:
+        entries = list(_stale_cache.items())
+    for (url, params, auth_token), value in entries:
+        yield {"url": url, "params": params, "token": auth_token}, json.dumps(value).encode('utf-8')
+
+
+def restore_stale_cache(meta, body, created_at):
+    """Puts back a snapshot record, unless the snapshot is older than STALE_SNAPSHOT_MAX_AGE."""
+    if time.time() - created_at > STALE_SNAPSHOT_MAX_AGE:
+        return False
+    key = (meta["url"], tuple(tuple(param) for param in meta["params"]), meta["token"])
+    global _stale_generation
+    with _stale_lock:
+        if key in _stale_cache:
+            return False
+        _stale_generation += 1
+        _stale_cache[key] = json.loads(body)
+        _stale_cache.move_to_end(key, last=False)
+        while len(_stale_cache) > STALE_CACHE_SIZE:
+            _stale_cache.popitem(last=False)
+    return True
+
+
+def _stale_response(key):
+    with _stale_lock:
+        return _stale_cache.get(key)
+
 
 class HttpClient:
     """
     A centralized HTTP client to manage requests, sessions, and authentication.
     """
 
-    def __init__(self, base_url, auth_prefix=""):
+    def __init__(self, base_url, auth_prefix="", timeout=None):
         """
         Initializes the client.
 
@@ -20,18 +93,21 @@ class HttpClient:
             base_url (str): The base URL for this API (e.g., "https://account-api.frommyarti.com")
             auth_prefix (str): A prefix for the Authorization header, e.g., "Bearer ".
                                Leave empty if no prefix is needed.
+            timeout (tuple): (connect, read) timeout, defaults to DEFAULT_TIMEOUT.
         """
         self.base_url = base_url
         self.auth_prefix = auth_prefix
         self.auth_token = None
-        self.session = requests.Session()
+        self.timeout = timeout or DEFAULT_TIMEOUT
+        self.breaker = get_breaker(base_url)
+        self.session = LIVE.track("api_sessions", mount_http2(requests.Session()))
 
     def set_token(self, token):
         """
         Sets the authentication token for this client instance.
         """
         self.auth_token = token
-        log.info(f"Token set for {self.base_url}")
+        log.debug("Token set for %s", self.base_url)
 
     def _request(self, method, endpoint, headers, params=None, json=None):
         """
@@ -46,34 +122,65 @@ class HttpClient:
 
         # Merge headers: priority is request-specific > auth > session-default
         full_headers = {**self.session.headers, **auth_header, **headers}
+        stale_key = _stale_key(url, params, self.auth_token) if method == "GET" else None
+
+        if not self.breaker.allow_request():
+            return self._fallback(stale_key, CircuitOpenError(f"API call to {url} skipped: circuit open"))
 
         try:
-            log.debug(f"Request: {method} {url}")
-            log.debug(f"Headers: {full_headers}")
-            log.debug(f"Params: {params}")
-            log.debug(f"JSON: {json}")
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("Request: %s %s", method, url)
+                log.debug("Headers: %s", full_headers)
+                log.debug("Params: %s", params)
+                log.debug("JSON: %s", json)
 
             response = self.session.request(
                 method=method,
                 url=url,
                 headers=full_headers,
                 params=params,
-                json=json
+                json=json,
+                timeout=self.timeout
             )
 
+            # Only server-side trouble counts against the breaker, not 4xx
+            if response.status_code >= 500:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+
             # Raise an exception for bad status codes (4xx or 5xx)
             response.raise_for_status()
 
             # Try to return JSON, fall back to text if empty or invalid
             try:
-                return response.json()
+                result = response.json()
             except requests.exceptions.JSONDecodeError:
-                log.warning(f"Response for {url} was not valid JSON. Returning text.")
+                log.warning("Response for %s was not valid JSON. Returning text.", url)
                 return response.text
 
+            if stale_key and isinstance(result, dict) and result.get("success"):
+                _remember_response(stale_key, result)
+            return result
+
         except requests.exceptions.RequestException as e:
-            log.error(f"API call failed: {e}")
-            raise ApiError(f"API call to {url} failed: {e}") from e
+            log.error("API call failed: %s", e)
+            if not isinstance(e, requests.exceptions.HTTPError):
+                self.breaker.record_failure()
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and status < 500:
+                raise ApiError(f"API call to {url} failed: {e}") from e
+            return self._fallback(stale_key, ApiError(f"API call to {url} failed: {e}"), cause=e)
+
+    def _fallback(self, stale_key, error, cause=None):
+        """
+        Returns the last good response for this call if there is one, raises error otherwise.
+        """
+        stale = _stale_response(stale_key) if stale_key else None
+        if stale is not None:
+            log.warning("Serving stale response for %s: %s", stale_key[0], error)
+            return stale
+        raise error from cause
 
     # Public convenience methods (GET, POST, etc.)
 
@@ -0,0 +1,91 @@
+import time
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from .FrommAPI import FrommAPI
+
+log = logging.getLogger(__name__)
+
+
+class TokenRefresher:
+    """
+    Refreshes access tokens off the request path.
+
+    Sessions live in the client cookie, so a background refresh cannot write
+    them: results are kept here, keyed by the access token they replace, and
+    picked up by the next request still carrying that token (collect()).
+    A refreshed session has a new access token, so its own next refresh
+    never finds an earlier result. One refresh at most runs per access token.
+    """
+
+    def __init__(self, max_workers=2, result_ttl=300):
+        self.result_ttl = result_ttl
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="token-refresh")
+        self._futures = {}  # { access_token: (started_at, future) }
+        self._lock = threading.Lock()
+
+    def _submit(self, session_data):
+        access_token = session_data.get("access_token")
+        now = time.monotonic()
+        with self._lock:
+            self._prune(now)
+            entry = self._futures.get(access_token)
+            if entry is None:
+                entry = (now, self._executor.submit(self._refresh, session_data))
+                self._futures[access_token] = entry
+            return entry[1]
+
+    def _refresh(self, session_data):
+        api = FrommAPI.from_session_data(session_data)
+        if api.refresh():
+            return api.get_session_data()
+        return None
+
+    def _prune(self, now):
+        for access_token, (started_at, future) in list(self._futures.items()):
+            if future.done() and now - started_at > self.result_ttl:
+                del self._futures[access_token]
+
+    def schedule(self, session_data):
+        """Starts a background refresh for this session if none is running or finished."""
+        if session_data and session_data.get("access_token") and session_data.get("refresh_token"):
+            self._submit(session_data)
+
+    def collect(self, access_token):
+        """
+        Returns the refreshed session data of a finished background refresh, or None.
+        The result stays available for the session's other in-flight requests.
+        """
+        with self._lock:
+            entry = self._futures.get(access_token)
+        if entry is None or not entry[1].done():
+            return None
+        try:
+            return entry[1].result()
+        except Exception as e:
+            log.warning("Background token refresh failed: %s", e)
+            return None
+
+    def refresh_now(self, session_data, timeout=15):
+        """
+        Refreshes synchronously (joining a running refresh if there is one).
+
+        Returns:
+            dict: The refreshed session data, or None on failure.
+        """
+        if not session_data or not session_data.get("access_token") or not session_data.get("refresh_token"):
+            return None
+        try:
+            return self._submit(session_data).result(timeout=timeout)
+        except Exception as e:
+            log.warning("Token refresh failed: %s", e)
+            return None
+
+    def stats(self):
+        with self._lock:
+            running = sum(1 for _, future in self._futures.values() if not future.done())
+            return {"tracked": len(self._futures), "running": running}
+
+
+TOKEN_REFRESHER = TokenRefresher()
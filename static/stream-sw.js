@@ -0,0 +1,166 @@
+// Service worker caching /stream/ playlists and segments in Cache Storage.
+//
+// One cache per post ("fromm-stream-v1-p<post_id>"), each limited to POST_QUOTA_BYTES
+// and evicted least recently used first. Only the MAX_POSTS most recently played posts are kept.
+// Segments are served cache first, playlists stale-while-revalidate so a changed
+// rendition policy or a grown I-frame index is picked up on the next load.
+
+const CACHE_PREFIX = 'fromm-stream-v1-p';
+const POST_QUOTA_BYTES = 256 * 1024 * 1024;
+const MAX_POSTS = 4;
+const STREAM_PATH = /^\/stream\/p(\d+)\//;
+
+// { post_id: Map(cache_key -> size) }, in LRU order. Rebuilt from the caches after a restart,
+// where insertion order stands in for recency.
+const indexes = new Map();
+
+self.addEventListener('install', () => self.skipWaiting());
+
+self.addEventListener('activate', (event) => {
+    event.waitUntil((async () => {
+        // Drop caches written by older versions of this worker
+        const names = await caches.keys();
+        await Promise.all(names
+            .filter((name) => name.startsWith('fromm-stream-') && !name.startsWith(CACHE_PREFIX))
+            .map((name) => caches.delete(name)));
+        await self.clients.claim();
+    })());
+});
+
+self.addEventListener('message', (event) => {
+    if (event.data?.type === 'clear') {
+        event.waitUntil(clearAll());
+    }
+});
+
+self.addEventListener('fetch', (event) => {
+    const request = event.request;
+    if (request.method !== 'GET' || request.headers.has('Range')) return;
+
+    const url = new URL(request.url);
+    const match = url.origin === self.location.origin && STREAM_PATH.exec(url.pathname);
+    if (!match) return;
+
+    const postId = match[1];
+    const key = cacheKey(url);
+    if (url.pathname.endsWith('.m3u8')) {
+        event.respondWith(staleWhileRevalidate(event, request, postId, key));
+    } else {
+        event.respondWith(cacheFirst(event, request, postId, key));
+    }
+});
+
+function cacheKey(url) {
+    // The tab id only picks the server-side credentials, the content is the same for every tab
+    const key = new URL(url);
+    key.searchParams.delete('tid');
+    return key.toString();
+}
+
+async function cacheFirst(event, request, postId, key) {
+    const cached = await lookup(postId, key);
+    if (cached) return cached;
+    const response = await fetch(request);
+    if (response.status === 200) {
+        event.waitUntil(store(postId, key, response.clone()));
+    }
+    return response;
+}
+
+async function staleWhileRevalidate(event, request, postId, key) {
+    const cached = await lookup(postId, key);
+    const refresh = fetch(request).then(async (response) => {
+        if (response.status === 200) {
+            await store(postId, key, response.clone());
+        }
+        return response;
+    });
+    if (cached) {
+        event.waitUntil(refresh.catch(() => {}));
+        return cached;
+    }
+    return refresh;
+}
+
+async function lookup(postId, key) {
+    const index = await loadIndex(postId);
+    if (!index.has(key)) return null;
+    const cache = await caches.open(CACHE_PREFIX + postId);
+    const response = await cache.match(key);
+    if (!response) {
+        index.delete(key);
+        return null;
+    }
+    touch(postId, index, key);
+    return response;
+}
+
+async function store(postId, key, response) {
+    const body = await response.blob();
+    if (body.size > POST_QUOTA_BYTES) return;
+
+    const headers = new Headers(response.headers);
+    headers.set('X-SW-Size', String(body.size));
+    const cache = await caches.open(CACHE_PREFIX + postId);
+    await cache.put(key, new Response(body, { status: 200, headers }));
+
+    const index = await loadIndex(postId);
+    index.set(key, body.size);
+    touch(postId, index, key);
+    await evict(cache, index);
+    await evictPosts();
+}
+
+function touch(postId, index, key) {
+    const size = index.get(key);
+    index.delete(key);
+    index.set(key, size);
+    indexes.delete(postId);
+    indexes.set(postId, index);
+}
+
+async function loadIndex(postId) {
+    let index = indexes.get(postId);
+    if (index) return index;
+
+    index = new Map();
+    const name = CACHE_PREFIX + postId;
+    if (await caches.has(name)) {
+        const cache = await caches.open(name);
+        for (const request of await cache.keys()) {
+            const response = await cache.match(request);
+            index.set(request.url, Number(response?.headers.get('X-SW-Size')) || 0);
+        }
+    }
+    indexes.set(postId, index);
+    return index;
+}
+
+async function evict(cache, index) {
+    let total = 0;
+    for (const size of index.values()) total += size;
+    for (const [key, size] of index) {
+        if (total <= POST_QUOTA_BYTES) break;
+        index.delete(key);
+        total -= size;
+        await cache.delete(key);
+    }
+}
+
+async function evictPosts() {
+    const names = (await caches.keys()).filter((name) => name.startsWith(CACHE_PREFIX));
+    if (names.length <= MAX_POSTS) return;
+    // Posts not played since the worker started are the oldest, then the in-memory LRU order
+    const loaded = Array.from(indexes.keys()).map((postId) => CACHE_PREFIX + postId).filter((name) => names.includes(name));
+    const order = names.filter((name) => !indexes.has(name.slice(CACHE_PREFIX.length))).concat(loaded);
+    for (const name of order.slice(0, names.length - MAX_POSTS)) {
+        indexes.delete(name.slice(CACHE_PREFIX.length));
+        await caches.delete(name);
+    }
+}
+
+async function clearAll() {
+    indexes.clear();
+    const names = await caches.keys();
+    await Promise.all(names.filter((name) => name.startsWith('fromm-stream-')).map((name) => caches.delete(name)));
+}
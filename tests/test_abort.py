@@ -0,0 +1,59 @@
+import time
+import select
+import socket
+import unittest
+
+from flask import Flask
+
+from util import abort_bench
+from util.streaming import _disconnect_probe
+
+
+@unittest.skipUnless(hasattr(select, 'poll'), "the disconnect probe needs poll()")
+class AbortTest(unittest.TestCase):
+    """Viewers leaving mid-segment must stop the upstream transfer (see util/abort_bench.py)."""
+
+    def _connected_pair(self):
+        listener = socket.create_server(("127.0.0.1", 0))
+        self.addCleanup(listener.close)
+        client = socket.create_connection(listener.getsockname())
+        server, _ = listener.accept()
+        self.addCleanup(server.close)
+        return client, server
+
+    def _probe(self, server):
+        app = Flask(__name__)
+        with app.test_request_context(environ_overrides={'werkzeug.socket': server}):
+            return _disconnect_probe()
+
+    def test_probe_sees_reset(self):
+        # A player aborting with response data still unread resets the connection
+        client, server = self._connected_pair()
+        server.sendall(bytes(64 * 1024))
+        time.sleep(0.05)
+        client.close()
+        time.sleep(0.05)
+        self.assertTrue(self._probe(server)())
+
+    def test_probe_sees_close(self):
+        client, server = self._connected_pair()
+        client.close()
+        time.sleep(0.05)
+        self.assertTrue(self._probe(server)())
+
+    def test_probe_ignores_connected_client(self):
+        client, server = self._connected_pair()
+        self.addCleanup(client.close)
+        disconnected = self._probe(server)
+        self.assertFalse(disconnected())
+        client.sendall(b"GET /next HTTP/1.1\r\n\r\n")  # a pipelined request is not a disconnect
+        time.sleep(0.05)
+        self.assertFalse(disconnected())
+
+    def test_upstream_stops_when_viewers_leave(self):
+        failures = abort_bench.run(viewers=20, size_mb=8, read_kb=300, max_after_kb=1024)
+        self.assertEqual(failures, [])
+
+
+if __name__ == '__main__':
+    unittest.main()
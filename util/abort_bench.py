@@ -0,0 +1,240 @@
+"""
+Viewers disconnecting in the middle of segments, against the real segment relay.
+
+A throttled stand-in for the content host runs in a child process and reports,
+for each request, when it wrote how many bytes. The proxy (proxy_stream_request
+behind the werkzeug server) runs in this process; viewers read part of a segment
+and close their socket, with the rest of the response still unread. All viewers
+are one user, so their relays mostly wait on the shared egress bucket: without
+the disconnect probe, upstream keeps sending through those waits. The run fails
+if a stream slot or pooled connection is left taken, if a viewer got less than it
+read for, or if upstream kept sending more than --max-after-kb per viewer after
+the viewer left. tests/test_abort.py runs it as a test.
+
+By default the process first opens enough descriptors for the sockets to land
+above 1024, where select() cannot be used.
+
+    python -m util.abort_bench [--viewers 20] [--size-mb 8] [--read-kb 300] [--max-after-kb 1024]
+                               [--fd-padding 1100]
+"""
+import os
+import sys
+import time
+import queue
+import socket
+import argparse
+import threading
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from flask import Flask
+from requests.adapters import HTTPAdapter
+from werkzeug.serving import make_server
+
+from util.metrics import METRICS
+from util.scheduler import SCHEDULER
+from util.upstream import UPSTREAM
+from util.diagnostics import connection_pool_stats
+from util.streaming import proxy_stream_request
+
+CONTENT_HOST = "content.invalid"
+
+
+def _serve(port, size, timelines, ready):
+    # port is a shared value, 0 picks a free port and is replaced by it
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            timeline = []  # (time.monotonic(), bytes sent so far), comparable across processes
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", str(size))
+            self.end_headers()
+            chunk = bytes(64 * 1024)
+            sent = 0
+            try:
+                while sent < size:
+                    self.wfile.write(chunk)
+                    sent += len(chunk)
+                    timeline.append((time.monotonic(), sent))
+                    time.sleep(0.005)  # ~12 MB/s, slower than the viewers read
+            except OSError:
+                pass
+            finally:
+                timelines.put((int(self.path.rsplit('_', 1)[-1].split('.')[0]), timeline))
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port.value), Handler)
+    port.value = server.server_address[1]
+    ready.set()
+    server.serve_forever()
+
+
+class _LocalContentHost(HTTPAdapter):
+    """Sends https://CONTENT_HOST/... to the local stand-in over plain HTTP."""
+
+    def __init__(self, port):
+        super().__init__()
+        self.port = port
+
+    def send(self, request, **kwargs):
+        request.url = request.url.replace(f"https://{CONTENT_HOST}", f"http://127.0.0.1:{self.port}", 1)
+        return super().send(request, **kwargs)
+
+
+def _pad_descriptors(count):
+    """Opens `count` descriptors so that the sockets opened afterwards get high numbers."""
+    try:
+        import resource
+        soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+        wanted = count + 1024
+        if soft < wanted and (hard == resource.RLIM_INFINITY or hard >= wanted):
+            resource.setrlimit(resource.RLIMIT_NOFILE, (wanted, hard))
+    except (ImportError, ValueError, OSError):
+        pass
+    padding = []
+    try:
+        for _ in range(count):
+            padding.append(os.open(os.devnull, os.O_RDONLY))
+    except OSError:
+        pass
+    return padding
+
+
+def run(viewers=20, size_mb=8, read_kb=300, max_after_kb=1024, fd_padding=1100, port=0):
+    """
+    Runs the simulation and prints its report.
+
+    Returns:
+        list: The failures found, empty if the run passed.
+    """
+    size = int(size_mb * 1024 * 1024)
+    timelines = multiprocessing.Queue()
+    ready = multiprocessing.Event()
+    upstream_port = multiprocessing.Value('i', port)
+    upstream = multiprocessing.Process(target=_serve, args=(upstream_port, size, timelines, ready), daemon=True)
+    upstream.start()
+    if not ready.wait(10):
+        upstream.terminate()
+        return ["the upstream stand-in did not start"]
+    padding = _pad_descriptors(fd_padding)
+    previous_adapter = UPSTREAM.session.adapters.get("https://")
+    UPSTREAM.session.mount("https://", _LocalContentHost(upstream_port.value))
+    counters_before = METRICS.snapshot()["counters"]
+
+    app = Flask(__name__)
+    creds = {"CloudFront-Key-Pair-Id": "K", "CloudFront-Signature": "S", "CloudFront-Policy": "P"}
+
+    @app.route('/segment/<int:number>')
+    def segment(number):
+        return proxy_stream_request(number, f"vod/seg_{number:05d}.ts", creds, CONTENT_HOST,
+                                    user_agent_string="abort-bench", device_info={"os": "Android"},
+                                    tab_id=f"tab{number}", user_id="bench")
+
+    server = make_server("127.0.0.1", 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    proxy_port = server.socket.getsockname()[1]
+
+    received_by_viewer = {}
+    left_at = {}
+
+    def viewer(number):
+        with socket.create_connection(("127.0.0.1", proxy_port)) as sock:
+            sock.sendall(f"GET /segment/{number} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+            received = 0
+            while received < read_kb * 1024:
+                data = sock.recv(65536)
+                if not data:
+                    break
+                received += len(data)
+        # Closed with the rest of the response unread: the kernel resets the connection
+        left_at[number] = time.monotonic()
+        received_by_viewer[number] = received
+
+    try:
+        started = time.perf_counter()
+        threads = [threading.Thread(target=viewer, args=(number,)) for number in range(viewers)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        deadline = time.monotonic() + 10
+        while SCHEDULER.active and time.monotonic() < deadline:
+            time.sleep(0.1)
+        elapsed = time.perf_counter() - started
+
+        sent, sent_after = 0, []
+        for _ in range(viewers):
+            try:
+                number, timeline = timelines.get(timeout=10)
+            except queue.Empty:
+                break
+            total = timeline[-1][1] if timeline else 0
+            at_leave = max((count for at, count in timeline if at <= left_at.get(number, 0)), default=0)
+            sent += total
+            sent_after.append(total - at_leave)
+
+        counters = METRICS.snapshot()["counters"]
+
+        def counted(name):
+            return counters.get(name, 0) - counters_before.get(name, 0)
+
+        pool = connection_pool_stats([UPSTREAM.session]).get("127.0.0.1", {})
+        full = size * viewers
+        worst_after = max(sent_after, default=0)
+        print(f"{viewers} viewers left after {read_kb} KiB in {elapsed:.2f} s "
+              f"(proxy listening on fd {server.socket.fileno()})")
+        print(f"upstream sent {sent / 1e6:.1f} MB of {full / 1e6:.1f} MB ({100 * sent / full:.0f}%), "
+              f"after the viewer left: {worst_after / 1024:.0f} KiB at most, "
+              f"{sum(sent_after) / max(1, len(sent_after)) / 1024:.0f} KiB on average")
+        print(f"aborts {counted('stream.aborts')}, "
+              f"relayed before abort {counted('stream.aborted_bytes_sent') / 1e6:.1f} MB, "
+              f"skipped {counted('stream.aborted_bytes_skipped') / 1e6:.1f} MB")
+        print(f"stream slots taken {SCHEDULER.active}, pooled connections in use {pool.get('in_use', 0)}")
+
+        failures = []
+        if len(received_by_viewer) < viewers or any(received < read_kb * 1024
+                                                     for received in received_by_viewer.values()):
+            failures.append("viewers got truncated bodies")
+        if SCHEDULER.active:
+            failures.append("stream slots leaked")
+        if pool.get("in_use"):
+            failures.append("upstream connections leaked")
+        if counted("stream.aborts") < viewers:
+            failures.append("disconnects not counted as aborts")
+        if len(sent_after) < viewers:
+            failures.append("upstream transfers did not end")
+        elif worst_after > max_after_kb * 1024:
+            failures.append(f"upstream kept sending {worst_after / 1024:.0f} KiB after a viewer left")
+        print("FAILED: " + ", ".join(failures) if failures else "OK")
+        return failures
+    finally:
+        server.shutdown()
+        server.server_close()
+        upstream.terminate()
+        upstream.join()
+        if previous_adapter is not None:
+            UPSTREAM.session.mount("https://", previous_adapter)
+        for fd in padding:
+            os.close(fd)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--viewers", type=int, default=20)
+    parser.add_argument("--size-mb", type=float, default=8)
+    parser.add_argument("--read-kb", type=int, default=300, help="bytes each viewer reads before leaving")
+    parser.add_argument("--max-after-kb", type=int, default=1024,
+                        help="bytes upstream may still send for a viewer once it left")
+    parser.add_argument("--fd-padding", type=int, default=1100)
+    parser.add_argument("--port", type=int, default=0, help="stand-in port, 0 for any free port")
+    args = parser.parse_args()
+    if run(args.viewers, args.size_mb, args.read_kb, args.max_after_kb, args.fd_padding, args.port):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
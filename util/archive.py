@@ -0,0 +1,208 @@
+import os
+import json
+import logging
+import mimetypes
+import threading
+
+from flask import send_file
+
+log = logging.getLogger(__name__)
+
+MANIFEST_NAME = "manifest.json"
+MANIFEST_VERSION = 1
+
+# HLS types are not always known to the platform mimetypes table
+CONTENT_TYPES = {
+    ".m3u8": "application/vnd.apple.mpegurl",
+    ".ts": "video/mp2t",
+    ".aac": "audio/aac",
+    ".key": "application/octet-stream",
+}
+
+
+def guess_content_type(path):
+    ext = os.path.splitext(path)[1].lower()
+    if ext in CONTENT_TYPES:
+        return CONTENT_TYPES[ext]
+    return mimetypes.guess_type(path)[0] or "application/octet-stream"
+
+
+class ArchiveIndex:
+    """
+    Index of VODs archived on local disk.
+
+    Layout:
+        <root>/p<post_id>/manifest.json
+        <root>/p<post_id>/<video_path>      (same path as on the content host)
+
+    Nothing in the server writes archives: the files of a post are copied into
+    its directory by hand and the manifest is built with
+    `python -m util.archive <root> <post_id>`.
+
+    The manifest lists every archived file of a post, so once it is loaded
+    a lookup is a single dict access instead of a directory scan.
+    Manifests are loaded lazily and kept in memory; a lookup only stats the
+    manifest file, so one (re)built by `python -m util.archive` in another
+    process is picked up by a running server.
+    """
+
+    def __init__(self, root):
+        self.root = os.path.abspath(root) if root else None
+        self._manifests = {}  # { post_id: (manifest mtime_ns, manifest dict) }
+        self._lock = threading.Lock()
+
+    @property
+    def enabled(self):
+        return bool(self.root) and os.path.isdir(self.root)
+
+    def post_dir(self, post_id):
+        return os.path.join(self.root, f"p{post_id}")
+
+    def get_manifest(self, post_id):
+        """
+        Returns the manifest of an archived post, or None if the post is not archived.
+        """
+        if not self.enabled:
+            return None
+        post_id = int(post_id)
+        try:
+            mtime = os.stat(os.path.join(self.post_dir(post_id), MANIFEST_NAME)).st_mtime_ns
+        except OSError:
+            # Not archived (misses are not cached, the archive may be built later)
+            with self._lock:
+                self._manifests.pop(post_id, None)
+            return None
+        cached = self._manifests.get(post_id)
+        if cached is not None and cached[0] == mtime:
+            return cached[1]
+
+        manifest = self._read_manifest(post_id)
+        with self._lock:
+            if manifest is None:
+                self._manifests.pop(post_id, None)
+            else:
+                self._manifests[post_id] = (mtime, manifest)
+        return manifest
+
+    def _read_manifest(self, post_id):
+        path = os.path.join(self.post_dir(post_id), MANIFEST_NAME)
+        try:
+            with open(path, "r", encoding="utf-8") as f:
+                manifest = json.load(f)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            log.error(f"Unreadable archive manifest {path}: {e}")
+            return None
+
+        if manifest.get("version") != MANIFEST_VERSION:
+            log.warning(f"Ignoring archive manifest {path} with version {manifest.get('version')}")
+            return None
+        return manifest
+
+    def is_archived(self, post_id):
+        return self.get_manifest(post_id) is not None
+
+    def get_post_data(self, post_id):
+        """
+        Returns the post data of the archive (same shape as the one returned by
+        /api/post), or None. It is the manifest's "post" entry, added by hand and
+        kept by rebuild_manifest; without it the player starts from entry_playlist.
+        """
+        manifest = self.get_manifest(post_id)
+        if not manifest:
+            return None
+        return manifest.get("post")
+
+    def entry_playlist(self, post_id):
+        """
+        Returns the path of the playlist to start an archived post from, or None:
+        the least nested .m3u8, preferring a master playlist. Used when the archive
+        was built without post data (rebuild_manifest).
+        """
+        manifest = self.get_manifest(post_id)
+        playlists = [key for key in (manifest or {}).get("files", {}) if key.endswith(".m3u8")]
+        if not playlists:
+            return None
+        return min(playlists, key=lambda key: (key.count('/'), 'master' not in key.rsplit('/', 1)[-1], key))
+
+    def resolve(self, post_id, video_path):
+        """
+        Resolves a stream path to a file on disk.
+
+        Args:
+            post_id (int): The post id.
+            video_path (str): The path as requested by the player (e.g. 'hls/1080p/video.m3u8').
+
+        Returns:
+            tuple: (absolute_path, file_entry) or None if the file is not archived.
+        """
+        manifest = self.get_manifest(post_id)
+        if not manifest:
+            return None
+        key = video_path.lstrip('/')
+        entry = manifest.get("files", {}).get(key)
+        if entry is None:
+            return None
+        return os.path.join(self.post_dir(post_id), *key.split('/')), entry
+
+    def _write_manifest(self, post_id, manifest):
+        post_dir = self.post_dir(post_id)
+        os.makedirs(post_dir, exist_ok=True)
+        path = os.path.join(post_dir, MANIFEST_NAME)
+        tmp_path = f"{path}.part"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, path)
+        self._manifests[int(post_id)] = (os.stat(path).st_mtime_ns, manifest)
+
+    def rebuild_manifest(self, post_id):
+        """
+        Rebuilds a post manifest from the files present on disk.
+        This is the only place that walks the archive directory.
+        """
+        post_dir = self.post_dir(post_id)
+        previous = self._read_manifest(int(post_id)) or {}
+        files = {}
+        for dirpath, _, filenames in os.walk(post_dir):
+            for name in filenames:
+                if name == MANIFEST_NAME or name.endswith(".part"):
+                    continue
+                full_path = os.path.join(dirpath, name)
+                key = os.path.relpath(full_path, post_dir).replace(os.sep, '/')
+                files[key] = {"size": os.path.getsize(full_path), "type": guess_content_type(key)}
+
+        manifest = {"version": MANIFEST_VERSION, "post": previous.get("post"), "files": files}
+        with self._lock:
+            self._write_manifest(post_id, manifest)
+        return manifest
+
+    def stats(self):
+        return {"posts_in_memory": len(self._manifests)}
+
+
+def serve_archived_file(path, entry):
+    """
+    Serves an archived file straight from disk.
+
+    send_file hands the open file to the server's wsgi.file_wrapper, which lets
+    the server use os.sendfile, and answers Range / conditional requests itself.
+    """
+    return send_file(
+        path,
+        mimetype=entry.get("type") or guess_content_type(path),
+        conditional=True,
+        etag=True,
+        max_age=3600
+    )
+
+
+if __name__ == '__main__':
+    # python -m util.archive <archive_dir> <post_id> [<post_id> ...]
+    import sys
+
+    logging.basicConfig(level=logging.INFO)
+    index = ArchiveIndex(sys.argv[1])
+    for arg in sys.argv[2:]:
+        rebuilt = index.rebuild_manifest(int(arg))
+        log.info(f"Rebuilt manifest for post {arg}: {len(rebuilt['files'])} files")
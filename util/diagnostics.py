@@ -0,0 +1,263 @@
+import os
+import gc
+import sys
+import time
+import weakref
+import threading
+import tracemalloc
+from collections import defaultdict
+from contextlib import contextmanager
+
+# Objects visited by deep_sizeof before it gives up and reports a lower bound
+DEEP_SIZEOF_LIMIT = 200000
+
+
+def deep_sizeof(obj, limit=DEEP_SIZEOF_LIMIT):
+    """
+    Approximate memory held by obj and the containers and values it references.
+
+    Returns:
+        tuple: (bytes, complete) - complete is False when the walk hit `limit`.
+    """
+    seen = set()
+    stack = [obj]
+    total = 0
+    while stack:
+        if len(seen) >= limit:
+            return total, False
+        item = stack.pop()
+        if id(item) in seen:
+            continue
+        seen.add(id(item))
+        total += sys.getsizeof(item)
+        if isinstance(item, dict):
+            stack.extend(item.keys())
+            stack.extend(item.values())
+        elif isinstance(item, (list, tuple, set, frozenset)):
+            stack.extend(item)
+        elif hasattr(item, '__dict__') and not isinstance(item, type):
+            stack.append(vars(item))
+    return total, True
+
+
+class LiveObjects:
+    """
+    Weakly tracks live objects by kind (sessions, streaming bodies, ...), so objects
+    that are never released show up as a growing count, plus the number of
+    sections currently running per kind.
+    """
+
+    def __init__(self):
+        self._objects = defaultdict(weakref.WeakSet)
+        self._active = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def track(self, kind, obj):
+        """Tracks obj until it is garbage collected. Returns obj."""
+        with self._lock:
+            self._objects[kind].add(obj)
+        return obj
+
+    def objects(self, kind):
+        with self._lock:
+            return list(self._objects[kind])
+
+    @contextmanager
+    def active(self, kind):
+        with self._lock:
+            self._active[kind] += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._active[kind] -= 1
+
+    def stats(self):
+        with self._lock:
+            return {
+                "live": {kind: len(objects) for kind, objects in self._objects.items()},
+                "active": dict(self._active),
+            }
+
+
+def connection_pool_stats(sessions):
+    """
+    Connection counts of the urllib3 pools behind requests sessions, per host.
+
+    Returns:
+        dict: { host: {"pools", "in_use", "idle", "opened", "requests"} }
+    """
+    hosts = {}
+    seen_adapters = set()
+    for session in sessions:
+        for adapter in list(session.adapters.values()):
+            if id(adapter) in seen_adapters:
+                continue
+            seen_adapters.add(id(adapter))
+            if hasattr(adapter, 'pool_stats'):
+                # HTTP/2 adapter (util.http2): multiplexed connections
+                for host, stats in adapter.pool_stats().items():
+                    hosts.setdefault(host, {}).update({f"h2_{name}": value for name, value in stats.items()})
+                adapter = adapter.fallback
+            pools = adapter.poolmanager.pools
+            for key in list(pools.keys()):
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                queued = list(pool.pool.queue) if pool.pool is not None else []
+                stats = hosts.setdefault(pool.host, {})
+                for name in ("pools", "in_use", "idle", "opened", "requests"):
+                    stats.setdefault(name, 0)
+                stats["pools"] += 1
+                stats["in_use"] += pool.pool.maxsize - len(queued) if pool.pool is not None else 0
+                stats["idle"] += sum(1 for conn in queued if conn is not None)
+                stats["opened"] += pool.num_connections
+                stats["requests"] += pool.num_requests
+    return hosts
+
+
+def process_stats():
+    """Resident memory, thread count and garbage collector state of this process."""
+    stats = {
+        "threads": threading.active_count(),
+        "gc_counts": gc.get_count(),
+        "gc_objects": len(gc.get_objects()),
+    }
+    try:
+        with open("/proc/self/status", "r") as f:
+            for line in f:
+                if line.startswith(("VmRSS:", "VmHWM:")):
+                    name, value = line.split(":", 1)
+                    stats[name.lower()] = int(value.split()[0]) * 1024
+    except OSError:
+        import resource
+        # ru_maxrss is in KiB on Linux, bytes on macOS
+        stats["max_rss"] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return stats
+
+
+class MemoryTracer:
+    """
+    On-demand tracemalloc: start() takes a baseline snapshot, diff() reports the
+    allocation growth since then grouped by module. Tracing slows allocations down,
+    so it is off until started and should be stopped after the investigation.
+    """
+
+    def __init__(self):
+        self._baseline = None
+        self._started_at = None
+        self._lock = threading.Lock()
+
+    @property
+    def tracing(self):
+        return tracemalloc.is_tracing()
+
+    def start(self, frames=1):
+        """Starts tracing if needed and (re)takes the baseline snapshot."""
+        with self._lock:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start(frames)
+            self._baseline = self._snapshot()
+            self._started_at = time.time()
+
+    def stop(self):
+        with self._lock:
+            self._baseline = None
+            self._started_at = None
+            if tracemalloc.is_tracing():
+                tracemalloc.stop()
+
+    def _snapshot(self):
+        return tracemalloc.take_snapshot().filter_traces([
+            tracemalloc.Filter(False, tracemalloc.__file__),
+            tracemalloc.Filter(False, "<frozen importlib._bootstrap*>"),
+            tracemalloc.Filter(False, "<unknown>"),
+        ])
+
+    def diff(self, limit=30, reset=False):
+        """
+        Allocation growth since the baseline, grouped by module.
+
+        Args:
+            limit (int): Modules reported, largest absolute growth first.
+            reset (bool): Make the current snapshot the new baseline.
+
+        Returns:
+            dict: The baseline time, traced totals and the per-module rows,
+                  or None if tracing was not started.
+        """
+        with self._lock:
+            if self._baseline is None or not tracemalloc.is_tracing():
+                return None
+            current = self._snapshot()
+            baseline, started_at = self._baseline, self._started_at
+            if reset:
+                self._baseline, self._started_at = current, time.time()
+
+        modules = _modules_by_file()
+        rows = {}
+        for stat in current.compare_to(baseline, 'filename'):
+            filename = stat.traceback[0].filename
+            module = modules.get(filename, filename)
+            row = rows.setdefault(module, {"module": module, "size": 0, "size_diff": 0, "count": 0, "count_diff": 0})
+            row["size"] += stat.size
+            row["size_diff"] += stat.size_diff
+            row["count"] += stat.count
+            row["count_diff"] += stat.count_diff
+
+        traced, peak = tracemalloc.get_traced_memory()
+        return {
+            "baseline_at": started_at,
+            "traced_bytes": traced,
+            "traced_peak_bytes": peak,
+            "modules": sorted(rows.values(), key=lambda row: abs(row["size_diff"]), reverse=True)[:limit],
+        }
+
+
+def _modules_by_file():
+    modules = {}
+    for name, module in list(sys.modules.items()):
+        filename = getattr(module, '__file__', None)
+        if filename:
+            filename = os.path.abspath(filename)
+            # Aliases such as requests.packages.urllib3 share the file, keep the canonical name
+            if filename not in modules or len(name) < len(modules[filename]):
+                modules[filename] = name
+    return modules
+
+
+class Diagnostics:
+    """
+    Registry of the in-process stores and caches reported by the admin diagnostics endpoint.
+    """
+
+    def __init__(self):
+        self._stores = {}
+
+    def register_store(self, name, store):
+        """
+        Args:
+            name (str): Report key.
+            store: A container (its length and deep size are reported) or a
+                   callable returning its own stats dict.
+        """
+        self._stores[name] = store
+
+    def stores(self):
+        report = {}
+        for name, store in list(self._stores.items()):
+            try:
+                if callable(store):
+                    report[name] = store()
+                    continue
+                snapshot = dict(store) if isinstance(store, dict) else list(store)
+                size, complete = deep_sizeof(snapshot)
+                report[name] = {"entries": len(snapshot), "approx_bytes": size, "complete": complete}
+            except Exception as e:
+                report[name] = {"error": str(e)}
+        return report
+
+
+LIVE = LiveObjects()
+TRACER = MemoryTracer()
+DIAGNOSTICS = Diagnostics()
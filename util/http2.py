@@ -0,0 +1,238 @@
+import time
+import atexit
+import logging
+import threading
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import get_encoding_from_headers
+
+from util.metrics import METRICS
+
+try:
+    import httpx
+except ImportError:  # optional dependency: pip install "httpx[http2]"
+    httpx = None
+
+log = logging.getLogger(__name__)
+
+# Connection-specific headers, forbidden in HTTP/2 (RFC 9113 8.2.2)
+HOP_BY_HOP_HEADERS = {"connection", "keep-alive", "proxy-connection", "transfer-encoding", "upgrade", "host"}
+
+# After an HTTP/2 protocol error, a host is served over HTTP/1.1 for this long (seconds)
+FALLBACK_SECONDS = 300
+
+IDEMPOTENT_METHODS = {"GET", "HEAD", "OPTIONS"}
+
+
+def http2_available():
+    """True if httpx and its h2 extra are installed."""
+    if httpx is None:
+        return False
+    try:
+        import h2  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+class _HttpxRaw:
+    """
+    The `raw` of a requests.Response backed by a streamed httpx response:
+    enough of urllib3's HTTPResponse for iter_content, .content and close().
+    """
+
+    def __init__(self, response):
+        self._response = response
+        self._stream = None
+        self._pending = b''
+
+    def stream(self, chunk_size, decode_content=True):
+        iterator = self._response.iter_bytes(chunk_size) if decode_content else self._response.iter_raw(chunk_size)
+        yield from self._translate_errors(iterator)
+
+    @staticmethod
+    def _translate_errors(iterator):
+        # Callers handle requests exceptions, not httpx ones
+        try:
+            yield from iterator
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ConnectionError(e) from e
+        except httpx.HTTPError as e:
+            raise requests.exceptions.ChunkedEncodingError(e) from e
+
+    def read(self, amt=None, decode_content=True):
+        if self._stream is None:
+            self._stream = self._translate_errors(self._response.iter_bytes())
+        if amt is None:
+            data = self._pending + b''.join(self._stream)
+            self._pending = b''
+            return data
+        while len(self._pending) < amt:
+            chunk = next(self._stream, None)
+            if chunk is None:
+                break
+            self._pending += chunk
+        data, self._pending = self._pending[:amt], self._pending[amt:]
+        return data
+
+    def release_conn(self):
+        self._response.close()
+
+    def close(self):
+        self._response.close()
+
+
+class Http2Adapter(BaseAdapter):
+    """
+    requests transport adapter sending through a shared httpx client, so HTTP/2
+    multiplexes concurrent requests over a few connections per host.
+
+    Falls back to HTTP/1.1:
+      - per connection, when the server does not offer h2 (ALPN), inside httpx;
+      - per host for FALLBACK_SECONDS after an HTTP/2 protocol error, through a
+        regular HTTPAdapter (idempotent requests are resent there once).
+
+    The adapter and its connections are shared by every session it is mounted on;
+    close() on one session does not close it.
+    """
+
+    def __init__(self, max_connections=4, max_keepalive=4, prior_knowledge=False):
+        """
+        Args:
+            max_connections (int): Connections per host (each multiplexes many streams).
+            max_keepalive (int): Idle connections kept per host.
+            prior_knowledge (bool): Speak HTTP/2 without TLS/ALPN negotiation (h2c), for local servers.
+        """
+        super().__init__()
+        if not http2_available():
+            raise RuntimeError('HTTP/2 transport needs the optional dependency: pip install "httpx[http2]"')
+        self.client = httpx.Client(
+            transport=httpx.HTTPTransport(
+                http1=not prior_knowledge,
+                http2=True,
+                limits=httpx.Limits(max_connections=max_connections, max_keepalive_connections=max_keepalive),
+            ),
+            follow_redirects=False,
+        )
+        self.fallback = HTTPAdapter(pool_connections=8, pool_maxsize=32)
+        self._fallback_until = {}  # { host: monotonic deadline }
+        self._lock = threading.Lock()
+
+    def _use_fallback(self, host):
+        with self._lock:
+            until = self._fallback_until.get(host)
+            if until is not None and until < time.monotonic():
+                del self._fallback_until[host]
+                until = None
+        return until is not None
+
+    def _mark_fallback(self, host, error):
+        log.warning("HTTP/2 to %s failed (%s), using HTTP/1.1 for %ds", host, error, FALLBACK_SECONDS)
+        METRICS.incr("http2.fallbacks")
+        with self._lock:
+            self._fallback_until[host] = time.monotonic() + FALLBACK_SECONDS
+
+    @staticmethod
+    def _timeout(timeout):
+        if isinstance(timeout, tuple):
+            connect, read = timeout
+        else:
+            connect = read = timeout
+        return httpx.Timeout(connect=connect, read=read, write=read, pool=read)
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        host = urlsplit(request.url).hostname
+        if self._use_fallback(host):
+            return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                      proxies=proxies)
+
+        headers = [(name, value) for name, value in request.headers.items()
+                   if name.lower() not in HOP_BY_HOP_HEADERS]
+        body = request.body.encode('utf-8') if isinstance(request.body, str) else request.body
+        try:
+            httpx_request = self.client.build_request(
+                request.method, request.url, headers=headers, content=body, timeout=self._timeout(timeout)
+            )
+            response = self.client.send(httpx_request, stream=True)
+        except httpx.ConnectTimeout as e:
+            raise requests.exceptions.ConnectTimeout(e, request=request) from e
+        except httpx.TimeoutException as e:
+            raise requests.exceptions.ReadTimeout(e, request=request) from e
+        except httpx.ProtocolError as e:
+            self._mark_fallback(host, e)
+            if request.method in IDEMPOTENT_METHODS:
+                return self.fallback.send(request, stream=stream, timeout=timeout, verify=verify, cert=cert,
+                                          proxies=proxies)
+            raise requests.exceptions.ConnectionError(e, request=request) from e
+        except httpx.TransportError as e:
+            raise requests.exceptions.ConnectionError(e, request=request) from e
+
+        METRICS.incr("http2.requests" if response.http_version == "HTTP/2" else "http2.http1_requests")
+        # requests.Session.send reads the body itself unless stream=True
+        return self._build_response(request, response)
+
+    def _build_response(self, request, httpx_response):
+        response = requests.Response()
+        response.status_code = httpx_response.status_code
+        response.headers = CaseInsensitiveDict(httpx_response.headers.items())
+        response.encoding = get_encoding_from_headers(response.headers)
+        response.raw = _HttpxRaw(httpx_response)
+        response.reason = httpx_response.reason_phrase
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def close(self):
+        # Shared by every mounted session, closed at exit instead
+        pass
+
+    def shutdown(self):
+        self.client.close()
+        self.fallback.close()
+
+    def pool_stats(self):
+        """Connection counts per host: {host: {"connections", "http2", "idle"}}."""
+        hosts = {}
+        pool = getattr(self.client._transport, '_pool', None)
+        for connection in list(getattr(pool, 'connections', [])):
+            info = connection.info()  # e.g. "'https://host:443', HTTP/2, IDLE, Request Count: 3"
+            host = urlsplit(info.split("'")[1]).hostname if "'" in info else "?"
+            stats = hosts.setdefault(host, {"connections": 0, "http2": 0, "idle": 0})
+            stats["connections"] += 1
+            stats["http2"] += "HTTP/2" in info
+            stats["idle"] += connection.is_idle()
+        return hosts
+
+
+_adapter = None
+
+
+def enable_http2(max_connections=4):
+    """
+    Creates the shared HTTP/2 adapter. Returns it, or None (HTTP/1.1 stays in use)
+    when the optional dependency is missing.
+    """
+    global _adapter
+    if _adapter is None:
+        if not http2_available():
+            log.warning('HTTP/2 requested but httpx[http2] is not installed, staying on HTTP/1.1')
+            return None
+        _adapter = Http2Adapter(max_connections=max_connections, max_keepalive=max_connections)
+        atexit.register(_adapter.shutdown)
+    return _adapter
+
+
+def http2_adapter():
+    """The shared adapter if enable_http2() was called, else None."""
+    return _adapter
+
+
+def mount_http2(session):
+    """Sends the session's https:// requests over the shared HTTP/2 adapter, if enabled."""
+    if _adapter is not None:
+        session.mount("https://", _adapter)
+    return session
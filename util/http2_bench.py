@@ -0,0 +1,169 @@
+"""
+Concurrent upstream fetches over HTTP/1.1 (requests' pooled HTTPAdapter) and over
+HTTP/2 (util.http2.Http2Adapter), each against a local stand-in server in a child
+process that answers after a fixed delay, like a CDN edge.
+
+Reports wall time, client CPU time and the TCP connections the server accepted.
+Needs the optional dependency: pip install "httpx[http2]"
+
+    python -m util.http2_bench [--requests 256] [--concurrency 32] [--size-kb 256] [--latency-ms 20]
+"""
+import time
+import socket
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from util.http2 import Http2Adapter, http2_available
+
+
+def _serve_http1(port, body, latency, connections, ready):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def setup(self):
+            super().setup()
+            with connections.get_lock():
+                connections.value += 1
+
+        def do_GET(self):
+            time.sleep(latency)
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    ready.set()
+    server.serve_forever()
+
+
+def _serve_http2(port, body, latency, connections, ready):
+    """Minimal h2c (prior knowledge) server on the h2 state machine, one thread per stream."""
+    import h2.config
+    import h2.events
+    import h2.exceptions
+    import h2.connection
+
+    def respond(sock, conn, lock, window_open, stream_id):
+        time.sleep(latency)
+        try:
+            with lock:
+                conn.send_headers(stream_id, [
+                    (":status", "200"), ("content-type", "video/mp2t"), ("content-length", str(len(body)))
+                ])
+                sock.sendall(conn.data_to_send())
+            offset = 0
+            while offset < len(body):
+                with lock:
+                    while True:
+                        size = min(conn.local_flow_control_window(stream_id), conn.max_outbound_frame_size,
+                                   len(body) - offset)
+                        if size > 0:
+                            break
+                        window_open.wait()
+                    conn.send_data(stream_id, body[offset:offset + size], end_stream=offset + size == len(body))
+                    sock.sendall(conn.data_to_send())
+                offset += size
+        except (h2.exceptions.StreamClosedError, OSError):
+            pass
+
+    def handle(sock):
+        conn = h2.connection.H2Connection(config=h2.config.H2Configuration(client_side=False))
+        lock = threading.Lock()
+        window_open = threading.Condition(lock)
+        with lock:
+            conn.initiate_connection()
+            sock.sendall(conn.data_to_send())
+        try:
+            while True:
+                data = sock.recv(65536)
+                if not data:
+                    return
+                with lock:
+                    events = conn.receive_data(data)
+                    sock.sendall(conn.data_to_send())
+                    window_open.notify_all()
+                for event in events:
+                    if isinstance(event, h2.events.RequestReceived):
+                        threading.Thread(target=respond, args=(sock, conn, lock, window_open, event.stream_id),
+                                         daemon=True).start()
+                    elif isinstance(event, h2.events.ConnectionTerminated):
+                        return
+        except (h2.exceptions.ProtocolError, OSError):
+            pass
+        finally:
+            sock.close()
+
+    listener = socket.create_server(("127.0.0.1", port))
+    ready.set()
+    while True:
+        sock, _ = listener.accept()
+        with connections.get_lock():
+            connections.value += 1
+        threading.Thread(target=handle, args=(sock,), daemon=True).start()
+
+
+def run(name, adapter, url, args, connections):
+    session = requests.Session()
+    session.mount("http://", adapter)
+
+    def fetch(_):
+        response = session.get(url, timeout=(3.05, 20))
+        response.raise_for_status()
+        return len(response.content)
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as pool:
+        list(pool.map(fetch, range(args.concurrency)))  # warm up
+        opened_before = connections.value
+        cpu_started, wall_started = time.process_time(), time.perf_counter()
+        received = sum(pool.map(fetch, range(args.requests)))
+        wall = time.perf_counter() - wall_started
+        cpu = time.process_time() - cpu_started
+    print(f"{name:10} {wall:6.2f} s wall  {cpu:6.2f} s CPU  {received / wall / 1e6:7.1f} MB/s  "
+          f"{connections.value - opened_before:4d} new connections ({connections.value} total)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--requests", type=int, default=256)
+    parser.add_argument("--concurrency", type=int, default=32)
+    parser.add_argument("--size-kb", type=int, default=256)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument("--connections", type=int, default=4, help="pool size per host, both transports")
+    args = parser.parse_args()
+    if not http2_available():
+        parser.error('this benchmark needs httpx[http2]')
+
+    body = bytes(args.size_kb * 1024)
+    latency = args.latency_ms / 1000
+    servers = []
+    try:
+        for name, target, port, adapter in (
+            ("HTTP/1.1", _serve_http1, 8796, HTTPAdapter(pool_connections=1, pool_maxsize=args.connections)),
+            ("HTTP/2", _serve_http2, 8797, Http2Adapter(max_connections=args.connections,
+                                                        max_keepalive=args.connections, prior_knowledge=True)),
+        ):
+            connections = multiprocessing.Value('i', 0)
+            ready = multiprocessing.Event()
+            server = multiprocessing.Process(target=target, args=(port, body, latency, connections, ready), daemon=True)
+            server.start()
+            servers.append(server)
+            ready.wait(10)
+            run(name, adapter, f"http://127.0.0.1:{port}/segment.ts", args, connections)
+    finally:
+        for server in servers:
+            server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,143 @@
+import os
+import json
+import logging
+import threading
+from collections import OrderedDict
+
+from util.metrics import METRICS
+from util.mpegts import KeyframeScanner
+
+log = logging.getLogger(__name__)
+
+
+class KeyframeIndex:
+    """
+    Persisted keyframe byte ranges of .ts segments, one small JSON file per segment:
+        <root>/p<post_id>/<video_path>.json
+        {"size": 123, "complete": true, "keyframes": [[offset, length, pts], ...]}
+
+    "complete" is False for entries built from a prefix of the segment only
+    (a Range fetch), they are replaced when the whole segment goes through the proxy.
+
+    Only posts whose I-frame playlist was requested are indexed and kept in
+    memory, the `max_posts` most recent ones. Loading a post lists its directory
+    once, so segments that were never indexed cost no disk access.
+    """
+
+    def __init__(self, root, max_posts=16):
+        self.root = os.path.abspath(root)
+        self.max_posts = max_posts
+        self._posts = OrderedDict()  # { post_id: (paths indexed on disk, { video_path: entry }) }
+        self._lock = threading.Lock()
+
+    def _path(self, post_id, video_path):
+        key = video_path.lstrip('/')
+        if ".." in key.split('/'):
+            raise ValueError(f"Invalid segment path: {video_path}")
+        return os.path.join(self.root, f"p{post_id}", *key.split('/')) + ".json"
+
+    def _list_post(self, post_id):
+        post_root = os.path.join(self.root, f"p{post_id}")
+        on_disk = set()
+        for directory, _, files in os.walk(post_root):
+            relative = os.path.relpath(directory, post_root).replace(os.sep, '/')
+            for name in files:
+                if name.endswith(".json"):
+                    on_disk.add(name[:-5] if relative == '.' else f"{relative}/{name[:-5]}")
+        return on_disk
+
+    def load_post(self, post_id):
+        """Marks the post as wanted for trick play: its segments get indexed from now on."""
+        post_id = int(post_id)
+        with self._lock:
+            post = self._posts.get(post_id)
+            if post is not None:
+                self._posts.move_to_end(post_id)
+                return post
+        post = (self._list_post(post_id), {})
+        with self._lock:
+            post = self._posts.setdefault(post_id, post)
+            self._posts.move_to_end(post_id)
+            while len(self._posts) > self.max_posts:
+                self._posts.popitem(last=False)
+        return post
+
+    def get(self, post_id, video_path):
+        video_path = video_path.lstrip('/')
+        on_disk, entries = self.load_post(post_id)
+        entry = entries.get(video_path)
+        if entry is not None or video_path not in on_disk:
+            return entry
+        try:
+            with open(self._path(post_id, video_path), "r", encoding="utf-8") as f:
+                entry = json.load(f)
+        except (OSError, ValueError) as e:
+            log.warning("Unreadable keyframe index for %s %s: %s", post_id, video_path, e)
+            on_disk.discard(video_path)
+            return None
+        entries[video_path] = entry
+        return entry
+
+    def store(self, post_id, video_path, keyframes, size, complete=True):
+        post_id, video_path = int(post_id), video_path.lstrip('/')
+        entry = {"size": size, "complete": complete, "keyframes": [list(k) for k in keyframes]}
+        path = self._path(post_id, video_path)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            tmp_path = f"{path}.part"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entry, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            log.warning("Could not persist keyframe index for %s %s: %s", post_id, video_path, e)
+        with self._lock:
+            post = self._posts.get(post_id)
+        if post is not None:
+            post[0].add(video_path)
+            post[1][video_path] = entry
+        METRICS.incr("keyframes.indexed")
+
+    def observe(self, post_id, video_path):
+        """
+        Returns a scanner to feed with the segment bytes as they are relayed, or None
+        if the segment is not a .ts file, is already fully indexed, or belongs to a
+        post nobody requested an I-frame playlist for.
+        """
+        if not video_path.endswith('.ts'):
+            return None
+        with self._lock:
+            wanted = int(post_id) in self._posts
+        if not wanted:
+            return None
+        entry = self.get(post_id, video_path)
+        if entry is not None and entry.get("complete"):
+            return None
+        return KeyframeScanner()
+
+    def finish(self, post_id, video_path, scanner):
+        """Stores what a scanner found once the whole segment went through it."""
+        keyframes = scanner.finish()
+        if scanner.valid:
+            self.store(post_id, video_path, keyframes, scanner.offset)
+
+    def scan_bytes(self, post_id, video_path, content):
+        scanner = self.observe(post_id, video_path)
+        if scanner is not None:
+            scanner.feed(content)
+            self.finish(post_id, video_path, scanner)
+
+    def stats(self):
+        with self._lock:
+            posts = list(self._posts.values())
+        return {
+            "posts_in_memory": len(posts),
+            "max_posts": self.max_posts,
+            "segments_in_memory": sum(len(entries) for _, entries in posts),
+        }
+
+
+KEYFRAMES = KeyframeIndex(os.environ.get(
+    'FROMM_KEYFRAME_DIR',
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'keyframes')
+))
+METRICS.register_provider("keyframes", KEYFRAMES.stats)
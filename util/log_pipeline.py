@@ -0,0 +1,125 @@
+import sys
+import time
+import queue
+import atexit
+import logging
+import threading
+from collections import OrderedDict
+from logging.handlers import QueueHandler, QueueListener
+
+from util.metrics import METRICS
+
+LOG_FORMAT = "%(asctime)s %(levelname)s %(name)s: %(message)s"
+
+
+class DroppingQueueHandler(QueueHandler):
+    """
+    QueueHandler that never blocks the caller: when the queue is full the
+    record is dropped and counted instead of waiting for the writer thread.
+    """
+
+    def prepare(self, record):
+        # The base class formats the message here, on the request thread.
+        # Records are handed over as-is and formatted by the writer thread instead.
+        return record
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            METRICS.incr("logging.dropped")
+
+
+class RateLimitFilter(logging.Filter):
+    """
+    Lets at most `burst` records per category through every `interval` seconds.
+
+    The category is the `category` extra if given, otherwise the logger name and
+    message template, which is why hot paths log with lazy %-style arguments
+    rather than f-strings. Loggers in `by_logger` build their templates per
+    record (werkzeug puts the client address and time in its access-log
+    template), so all their records share one category.
+    WARNING and above are never limited.
+    When a window closes, the next record reports how many were suppressed.
+    The least recently seen categories are forgotten past `max_categories`.
+    """
+
+    def __init__(self, interval=10.0, burst=10, max_level=logging.INFO,
+                 by_logger=("werkzeug",), max_categories=10000):
+        super().__init__()
+        self.interval = interval
+        self.burst = burst
+        self.max_level = max_level
+        self.by_logger = frozenset(by_logger)
+        self.max_categories = max_categories
+        self._windows = OrderedDict()  # { category: [window_start, count, suppressed] }, LRU order
+        self._lock = threading.Lock()
+
+    def _category(self, record):
+        category = getattr(record, "category", None)
+        if category:
+            return category
+        if record.name in self.by_logger:
+            return record.name
+        return record.name, record.msg
+
+    def filter(self, record):
+        if record.levelno > self.max_level:
+            return True
+        category = self._category(record)
+        now = time.monotonic()
+        with self._lock:
+            window = self._windows.get(category)
+            if window is not None:
+                self._windows.move_to_end(category)
+            if window is None or now - window[0] >= self.interval:
+                suppressed = window[2] if window else 0
+                self._windows[category] = [now, 1, 0]
+                while len(self._windows) > self.max_categories:
+                    self._windows.popitem(last=False)
+                if suppressed:
+                    record.msg = f"{record.msg} (+{suppressed} similar suppressed)"
+                return True
+            if window[1] < self.burst:
+                window[1] += 1
+                return True
+            window[2] += 1
+        METRICS.incr("logging.suppressed")
+        return False
+
+
+_listener = None
+
+
+def configure_logging(level=logging.INFO, stream=None, queue_size=10000, interval=10.0, burst=10):
+    """
+    Routes all logging through a bounded queue drained by a background thread,
+    so a slow terminal or collector never holds up a request thread.
+
+    Args:
+        level (int): The root log level.
+        stream: Where the writer thread writes, stdout by default.
+        queue_size (int): Records buffered before new ones are dropped.
+        interval (float): Rate-limit window in seconds, per category.
+        burst (int): Records allowed per category and window.
+    """
+    global _listener
+    if _listener is not None:
+        return
+
+    log_queue = queue.Queue(maxsize=queue_size)
+    queue_handler = DroppingQueueHandler(log_queue)
+    queue_handler.addFilter(RateLimitFilter(interval=interval, burst=burst))
+
+    stream_handler = logging.StreamHandler(stream or sys.stdout)
+    stream_handler.setFormatter(logging.Formatter(LOG_FORMAT))
+
+    root = logging.getLogger()
+    for handler in list(root.handlers):
+        root.removeHandler(handler)
+    root.addHandler(queue_handler)
+    root.setLevel(level)
+
+    _listener = QueueListener(log_queue, stream_handler, respect_handler_level=True)
+    _listener.start()
+    atexit.register(_listener.stop)
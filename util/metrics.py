@@ -0,0 +1,48 @@
+import threading
+import time
+
+
+class Metrics:
+    """
+    Minimal in-process metrics registry (counters and gauges).
+    Everything is kept in plain dicts so a snapshot is cheap to serialize.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._gauges = {}
+        self._providers = {}
+        self.started_at = time.time()
+
+    def incr(self, name, value=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        with self._lock:
+            self._gauges[name] = value
+
+    def get(self, name, default=0):
+        return self._counters.get(name, self._gauges.get(name, default))
+
+    def register_provider(self, name, func):
+        """
+        Registers a callable whose return value is included in snapshots,
+        for stats that are computed on demand rather than counted.
+        """
+        self._providers[name] = func
+
+    def snapshot(self):
+        with self._lock:
+            data = {
+                "uptime_seconds": round(time.time() - self.started_at, 1),
+                "counters": dict(self._counters),
+                "gauges": dict(self._gauges),
+            }
+        for name, func in list(self._providers.items()):
+            data[name] = func()
+        return data
+
+
+METRICS = Metrics()
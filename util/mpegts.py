@@ -0,0 +1,166 @@
+PACKET_SIZE = 188
+SYNC_BYTE = 0x47
+
+STREAM_TYPE_H264 = 0x1B
+STREAM_TYPE_HEVC = 0x24
+VIDEO_STREAM_TYPES = {0x01, 0x02, STREAM_TYPE_H264, STREAM_TYPE_HEVC}
+
+# Bytes of a PES payload searched for the keyframe NAL unit
+PROBE_BYTES = 2048
+
+
+def _parse_pts(header):
+    """Reads the 33 bit PTS of a PES header, None if absent."""
+    if len(header) < 14 or not header[7] & 0x80:
+        return None
+    p = header[9:14]
+    return ((p[0] >> 1) & 0x07) << 30 | p[1] << 22 | (p[2] >> 1) << 15 | p[3] << 7 | p[4] >> 1
+
+
+def _is_keyframe_payload(es, stream_type):
+    """Looks for an IDR (H.264) or IRAP (HEVC) NAL unit in the start of an elementary stream payload."""
+    start = 0
+    while True:
+        start = es.find(b'\x00\x00\x01', start)
+        if start < 0 or start + 3 >= len(es):
+            return False
+        nal = es[start + 3]
+        if stream_type == STREAM_TYPE_HEVC:
+            if 16 <= (nal >> 1) & 0x3F <= 21:
+                return True
+        elif nal & 0x1F == 5:
+            return True
+        start += 3
+
+
+class KeyframeScanner:
+    """
+    Incremental MPEG-TS scanner that finds keyframes without decoding anything:
+    only packet headers, the PAT/PMT and the start of each video PES are read.
+
+    Feed a .ts file in chunks of any size, then call finish().
+
+    Result: list of (offset, length, pts) byte ranges, one per keyframe access unit.
+    A range starts at the PAT preceding the keyframe when there is one, so it can
+    be decoded on its own, and ends where the next video PES starts.
+    """
+
+    def __init__(self):
+        self.keyframes = []
+        self.offset = 0          # Offset of the next packet to parse
+        self.valid = True
+        self._pending = b''
+        self._pmt_pid = None
+        self._video_pid = None
+        self._stream_type = None
+        self._last_pat = None
+        self._au_start = None    # Range start of the access unit being read
+        self._au_pts = None
+        self._au_key = False
+        self._probe = None       # First bytes of the current video PES, until classified
+
+    def feed(self, data):
+        if not self.valid:
+            return
+        if self._pending:
+            data = self._pending + bytes(data)
+        view = memoryview(data)
+        usable = len(view) - len(view) % PACKET_SIZE
+        for start in range(0, usable, PACKET_SIZE):
+            if view[start] != SYNC_BYTE:
+                self.valid = False
+                return
+            self._packet(view[start:start + PACKET_SIZE])
+            self.offset += PACKET_SIZE
+        self._pending = bytes(view[usable:])
+
+    def _packet(self, packet):
+        pusi = packet[1] & 0x40
+        pid = (packet[1] & 0x1F) << 8 | packet[2]
+        control = (packet[3] >> 4) & 0x03
+        payload_start = 4
+        random_access = False
+        if control & 0x02:
+            adaptation_length = packet[4]
+            if adaptation_length:
+                random_access = bool(packet[5] & 0x40)
+            payload_start = 5 + adaptation_length
+        if not control & 0x01 or payload_start >= PACKET_SIZE:
+            return
+        payload = packet[payload_start:]
+
+        if pid == 0:
+            self._last_pat = self.offset
+            if pusi:
+                self._parse_pat(payload)
+        elif pid == self._pmt_pid and pusi:
+            self._parse_pmt(payload)
+        elif pid == self._video_pid:
+            if pusi:
+                self._start_access_unit(payload, random_access)
+            elif self._probe is not None:
+                self._probe_more(payload)
+
+    def _section(self, payload):
+        pointer = payload[0]
+        return payload[1 + pointer:]
+
+    def _parse_pat(self, payload):
+        section = self._section(payload)
+        if len(section) < 8:
+            return
+        section_length = (section[1] & 0x0F) << 8 | section[2]
+        end = min(len(section), 3 + section_length - 4)
+        for i in range(8, end - 3, 4):
+            program_number = section[i] << 8 | section[i + 1]
+            if program_number:
+                self._pmt_pid = (section[i + 2] & 0x1F) << 8 | section[i + 3]
+                return
+
+    def _parse_pmt(self, payload):
+        section = self._section(payload)
+        if len(section) < 12:
+            return
+        section_length = (section[1] & 0x0F) << 8 | section[2]
+        end = min(len(section), 3 + section_length - 4)
+        i = 12 + ((section[10] & 0x0F) << 8 | section[11])
+        while i + 5 <= end:
+            stream_type = section[i]
+            elementary_pid = (section[i + 1] & 0x1F) << 8 | section[i + 2]
+            if stream_type in VIDEO_STREAM_TYPES:
+                self._video_pid = elementary_pid
+                self._stream_type = stream_type
+                return
+            i += 5 + ((section[i + 3] & 0x0F) << 8 | section[i + 4])
+
+    def _start_access_unit(self, payload, random_access):
+        previous_start = self._au_start
+        self._close_access_unit(self.offset)
+        use_pat = self._last_pat is not None and (previous_start is None or self._last_pat > previous_start)
+        self._au_start = self._last_pat if use_pat else self.offset
+        self._au_pts = _parse_pts(payload)
+        self._au_key = random_access
+        self._probe = None
+        if not random_access and len(payload) >= 9:
+            self._probe = bytearray(payload[9 + payload[8]:])
+            self._probe_more(b'')
+
+    def _probe_more(self, payload):
+        self._probe += payload
+        if _is_keyframe_payload(bytes(self._probe), self._stream_type):
+            self._au_key = True
+            self._probe = None
+        elif len(self._probe) >= PROBE_BYTES:
+            self._probe = None
+
+    def _close_access_unit(self, end):
+        if self._au_start is not None and self._au_key:
+            self.keyframes.append((self._au_start, end - self._au_start, self._au_pts))
+        self._au_start = None
+        self._au_key = False
+
+    def finish(self):
+        """Closes the last access unit. Returns the keyframe list."""
+        if self.valid:
+            self._close_access_unit(self.offset)
+        return self.keyframes
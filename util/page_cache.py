@@ -0,0 +1,60 @@
+import json
+import hashlib
+import threading
+from collections import OrderedDict
+
+from util.metrics import METRICS
+
+
+class PageCache:
+    """
+    Rendered HTML pages, one entry per (user, route), tagged with a fingerprint
+    of the data they were rendered from. A page is rendered again only when the
+    fingerprint of its data changes; the fingerprint doubles as a strong ETag.
+    """
+
+    def __init__(self, max_entries=512, version=""):
+        """
+        Args:
+            max_entries (int): Pages kept, least recently used evicted first.
+            version (str): Mixed into every fingerprint, change it when templates change.
+        """
+        self.max_entries = max_entries
+        self.version = version
+        self._entries = OrderedDict()  # { (user_key, route_key): (fingerprint, html) }
+        self._lock = threading.Lock()
+
+    def fingerprint(self, *parts):
+        """Stable hash of JSON-serializable parts (non-JSON values are hashed by their str())."""
+        payload = json.dumps([self.version, parts], sort_keys=True, separators=(',', ':'), default=str)
+        return hashlib.sha256(payload.encode('utf-8')).hexdigest()[:32]
+
+    def get_or_render(self, user_key, route_key, fingerprint, render):
+        """
+        Returns the cached HTML if it was rendered from the same fingerprint, otherwise
+        calls render() and caches its result in place of the previous version.
+        """
+        key = (user_key, route_key)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == fingerprint:
+                self._entries.move_to_end(key)
+                METRICS.incr("page_cache.hits")
+                return entry[1]
+
+        METRICS.incr("page_cache.renders")
+        html = render()
+        with self._lock:
+            self._entries[key] = (fingerprint, html)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return html
+
+    def stats(self):
+        with self._lock:
+            return {
+                "entries": len(self._entries),
+                "max_entries": self.max_entries,
+                "bytes": sum(len(html) for _, html in self._entries.values()),
+            }
@@ -0,0 +1,330 @@
+import re
+from collections import namedtuple
+from functools import lru_cache
+
+ATTRIBUTE_PATTERN = re.compile(r'([A-Z0-9-]+)=("[^"]*"|[^,]*)')
+
+Variant = namedtuple("Variant", ["tag", "uri", "bandwidth", "width", "height"])
+
+
+class RenditionPolicy(namedtuple("RenditionPolicy", ["max_bandwidth", "max_resolution", "start_variant"])):
+    """
+    Server-side rendition policy for master playlists.
+
+    max_bandwidth (int): drop variants whose BANDWIDTH is above this (bits/s).
+    max_resolution (int): drop variants whose smaller side is above this (e.g. 720),
+                          the smaller side so vertical videos are handled like the player does.
+    start_variant (str): 'lowest', 'highest' or a resolution such as '480',
+                         that variant is listed first so the player starts with it.
+
+    Any field can be None. Policies are hashable so rendered playlists can be memoized per policy.
+    """
+
+    @classmethod
+    def from_dict(cls, data):
+        data = data or {}
+        return cls(
+            max_bandwidth=_positive_int(data.get("max_bandwidth")),
+            max_resolution=_positive_int(data.get("max_resolution")),
+            start_variant=str(data["start_variant"]).lower() if data.get("start_variant") else None
+        )
+
+    def merge(self, other):
+        """Combines two policies, caps take the stricter value and other's start variant wins."""
+        def stricter(a, b):
+            return min(x for x in (a, b) if x) if (a or b) else None
+        return RenditionPolicy(
+            max_bandwidth=stricter(self.max_bandwidth, other.max_bandwidth),
+            max_resolution=stricter(self.max_resolution, other.max_resolution),
+            start_variant=other.start_variant or self.start_variant
+        )
+
+    def is_empty(self):
+        return not any(self)
+
+
+NO_POLICY = RenditionPolicy(None, None, None)
+
+
+def _positive_int(value):
+    try:
+        value = int(value)
+    except (TypeError, ValueError):
+        return None
+    return value if value > 0 else None
+
+
+def parse_attributes(tag_line):
+    """Parses the attribute list of an HLS tag into a dict."""
+    _, _, attribute_list = tag_line.partition(':')
+    return {key: value.strip('"') for key, value in ATTRIBUTE_PATTERN.findall(attribute_list)}
+
+
+def is_master_playlist(content):
+    return '#EXT-X-STREAM-INF' in content
+
+
+@lru_cache(maxsize=256)
+def parse_master_playlist(content):
+    """
+    Parses a master playlist once per distinct content.
+
+    Returns:
+        tuple: lines of the playlist, where each EXT-X-STREAM-INF/URI pair is replaced by a Variant.
+    """
+    items = []
+    lines = content.splitlines()
+    i = 0
+    while i < len(lines):
+        line = lines[i]
+        if line.startswith('#EXT-X-STREAM-INF'):
+            attributes = parse_attributes(line)
+            uri = lines[i + 1] if i + 1 < len(lines) else ''
+            width, _, height = attributes.get('RESOLUTION', '').partition('x')
+            items.append(Variant(
+                tag=line,
+                uri=uri,
+                bandwidth=_positive_int(attributes.get('BANDWIDTH')) or 0,
+                width=_positive_int(width),
+                height=_positive_int(height)
+            ))
+            i += 2
+            continue
+        items.append(line)
+        i += 1
+    return tuple(items)
+
+
+def _short_side(variant):
+    if variant.width and variant.height:
+        return min(variant.width, variant.height)
+    return None
+
+
+def select_variants(variants, policy):
+    """
+    Applies a policy to the variants of a master playlist.
+    Never returns an empty list: if nothing fits the caps, the lowest variant is kept.
+    """
+    selected = [
+        v for v in variants
+        if not (policy.max_bandwidth and v.bandwidth > policy.max_bandwidth)
+        and not (policy.max_resolution and (_short_side(v) or 0) > policy.max_resolution)
+    ]
+    if not selected and variants:
+        selected = [min(variants, key=lambda v: v.bandwidth)]
+
+    start = policy.start_variant
+    if start and selected:
+        if start == 'lowest':
+            first = min(selected, key=lambda v: v.bandwidth)
+        elif start == 'highest':
+            first = max(selected, key=lambda v: v.bandwidth)
+        else:
+            target = _positive_int(start) or 0
+            first = min(selected, key=lambda v: abs((_short_side(v) or 0) - target))
+        selected.remove(first)
+        selected.insert(0, first)
+    return selected
+
+
+def render_master_playlist(content, policy, iframe_playlists=False):
+    """
+    Renders a master playlist with the policy applied, from the memoized parse.
+    With iframe_playlists, an EXT-X-I-FRAME-STREAM-INF served by the proxy is listed
+    for every variant, unless the upstream playlist already has some.
+    """
+    items = parse_master_playlist(content)
+    variants = [item for item in items if isinstance(item, Variant)]
+    selected = select_variants(variants, policy)
+    if '#EXT-X-I-FRAME-STREAM-INF' in content:
+        iframe_playlists = False
+
+    lines = []
+    emitted = False
+    for item in items:
+        if isinstance(item, Variant):
+            if not emitted:
+                for variant in selected:
+                    lines.extend((variant.tag, variant.uri))
+                if iframe_playlists:
+                    lines.extend(iframe_stream_inf(variant) for variant in selected)
+                emitted = True
+            continue
+        lines.append(item)
+    return '\n'.join(lines) + '\n'
+
+
+def iframe_stream_inf(variant):
+    """The EXT-X-I-FRAME-STREAM-INF tag pointing to the proxy-generated I-frame playlist of a variant."""
+    attributes = parse_attributes(variant.tag)
+    directory, _, name = variant.uri.rpartition('/')
+    uri = f"{directory}/{IFRAME_PLAYLIST_DIR}/{name}" if directory else f"{IFRAME_PLAYLIST_DIR}/{name}"
+    tag = f"#EXT-X-I-FRAME-STREAM-INF:BANDWIDTH={max(1, variant.bandwidth // 10)}"
+    if 'RESOLUTION' in attributes:
+        tag += f",RESOLUTION={attributes['RESOLUTION']}"
+    if 'CODECS' in attributes:
+        # I-frame renditions carry no audio
+        video_codecs = [c for c in attributes['CODECS'].split(',') if not c.startswith('mp4a')]
+        tag += f',CODECS="{",".join(video_codecs)}"'
+    return f'{tag},URI="{uri}"'
+
+
+Segment = namedtuple("Segment", ["tags", "duration", "uri"])
+MediaPlaylist = namedtuple("MediaPlaylist", ["header", "segments", "trailer"])
+
+# Virtual segments are served by the proxy itself: <playlist dir>/__vseg/<playlist name>/<start>-<count>.ts
+VIRTUAL_SEGMENT_DIR = "__vseg"
+VIRTUAL_SEGMENT_PATTERN = re.compile(rf'^(?:(.*)/)?{VIRTUAL_SEGMENT_DIR}/([^/]+)/(\d+)-(\d+)\.ts$')
+
+# I-frame playlists are generated by the proxy: <media playlist dir>/__iframes/<media playlist name>
+IFRAME_PLAYLIST_DIR = "__iframes"
+IFRAME_PLAYLIST_PATTERN = re.compile(rf'^(?:(.*)/)?{IFRAME_PLAYLIST_DIR}/([^/]+\.m3u8)$')
+
+# Segments that cannot simply be concatenated: partial files, fMP4 init sections, encrypted media
+UNGROUPABLE_TAGS = ('#EXT-X-BYTERANGE', '#EXT-X-MAP', 'METHOD=AES-128', 'METHOD=SAMPLE-AES')
+
+
+@lru_cache(maxsize=32)
+def parse_media_playlist(content):
+    """
+    Parses a media playlist once per distinct content.
+
+    Returns:
+        MediaPlaylist: header lines, segments (with the tags preceding each one) and trailer lines.
+    """
+    header, segments, pending = [], [], []
+    duration = None
+    for line in content.splitlines():
+        if not line.strip():
+            continue
+        if line.startswith('#EXTINF'):
+            duration = float(line.partition(':')[2].split(',')[0] or 0)
+        elif line.startswith('#'):
+            if not segments and not pending and duration is None and not line.startswith('#EXT-X-DISCONTINUITY'):
+                header.append(line)
+            else:
+                pending.append(line)
+        else:
+            segments.append(Segment(tuple(pending), duration or 0.0, line))
+            pending, duration = [], None
+    return MediaPlaylist(tuple(header), tuple(segments), tuple(pending))
+
+
+def can_group_segments(content):
+    return not any(tag in content for tag in UNGROUPABLE_TAGS)
+
+
+def group_media_playlist(content, playlist_name, group_size):
+    """
+    Rewrites a media playlist so every group_size consecutive segments become one
+    virtual segment with the summed #EXTINF duration. Groups never span a segment
+    carrying its own tags (discontinuity, date-time...), those start a new group.
+
+    Returns:
+        str: the grouped playlist, with virtual segment URIs relative to the playlist.
+    """
+    playlist = parse_media_playlist(content)
+    groups = []  # (start index, count, duration)
+    for index, segment in enumerate(playlist.segments):
+        if groups and not segment.tags and groups[-1][1] < group_size:
+            start, count, duration = groups[-1]
+            groups[-1] = (start, count + 1, duration + segment.duration)
+        else:
+            groups.append((index, 1, segment.duration))
+
+    target_duration = max((int(-(-duration // 1)) for _, _, duration in groups), default=0)
+    lines = []
+    for line in playlist.header:
+        if line.startswith('#EXT-X-TARGETDURATION'):
+            line = f"#EXT-X-TARGETDURATION:{target_duration}"
+        lines.append(line)
+    for start, count, duration in groups:
+        first = playlist.segments[start]
+        lines.extend(first.tags)
+        lines.append(f"#EXTINF:{duration:.3f},")
+        if count == 1:
+            lines.append(first.uri)
+        else:
+            lines.append(f"{VIRTUAL_SEGMENT_DIR}/{playlist_name}/{start}-{count}.ts")
+    lines.extend(playlist.trailer)
+    return '\n'.join(lines) + '\n'
+
+
+def parse_virtual_segment_path(video_path):
+    """
+    Returns:
+        tuple: (playlist_path, start, count) for a virtual segment path, None otherwise.
+    """
+    match = VIRTUAL_SEGMENT_PATTERN.match(video_path.lstrip('/'))
+    if not match:
+        return None
+    base, playlist_name, start, count = match.groups()
+    playlist_path = f"{base}/{playlist_name}" if base else playlist_name
+    return playlist_path, int(start), int(count)
+
+
+def parse_iframe_playlist_path(video_path):
+    """
+    Returns:
+        str: the media playlist path an I-frame playlist path is generated from, None otherwise.
+    """
+    match = IFRAME_PLAYLIST_PATTERN.match(video_path.lstrip('/'))
+    if not match:
+        return None
+    base, playlist_name = match.groups()
+    return f"{base}/{playlist_name}" if base else playlist_name
+
+
+def render_iframe_playlist(content, indexes, prefix_bytes):
+    """
+    Builds an EXT-X-I-FRAMES-ONLY playlist from a media playlist and the keyframe index of its segments.
+
+    Args:
+        content (str): The media playlist.
+        indexes (list): Keyframe index entry (or None) for every segment of the playlist.
+        prefix_bytes (int): Range used for segments not indexed yet, they are expected
+                            to start with a keyframe.
+    Returns:
+        str: The I-frame playlist, with URIs relative to the media playlist.
+    """
+    playlist = parse_media_playlist(content)
+    entries = []  # (duration, length, offset, uri, tags)
+    for segment, entry in zip(playlist.segments, indexes):
+        tags = tuple(tag for tag in segment.tags if tag.startswith('#EXT-X-DISCONTINUITY'))
+        keyframes = entry.get("keyframes") if entry else None
+        if not keyframes:
+            entries.append((segment.duration, prefix_bytes, 0, segment.uri, tags))
+            continue
+
+        # Keyframe times relative to the segment start (taken as its first keyframe)
+        first_pts = keyframes[0][2]
+        times = [
+            (pts - first_pts) / 90000.0 if pts is not None and first_pts is not None else None
+            for _, _, pts in keyframes
+        ]
+        times.append(segment.duration)
+        for i, (offset, length, _) in enumerate(keyframes):
+            if times[i] is not None and times[i + 1] is not None:
+                duration = max(0.0, times[i + 1] - times[i])
+            else:
+                duration = segment.duration / len(keyframes)
+            entries.append((duration, length, offset, segment.uri, tags if i == 0 else ()))
+
+    target_duration = max((int(-(-duration // 1)) for duration, *_ in entries), default=1)
+    lines = [
+        "#EXTM3U",
+        "#EXT-X-VERSION:4",
+        f"#EXT-X-TARGETDURATION:{max(1, target_duration)}",
+        "#EXT-X-MEDIA-SEQUENCE:0",
+        "#EXT-X-PLAYLIST-TYPE:VOD",
+        "#EXT-X-I-FRAMES-ONLY",
+    ]
+    for duration, length, offset, uri, tags in entries:
+        lines.extend(tags)
+        lines.append(f"#EXTINF:{duration:.3f},")
+        lines.append(f"#EXT-X-BYTERANGE:{length}@{offset}")
+        lines.append(uri)
+    if '#EXT-X-ENDLIST' in playlist.trailer:
+        lines.append('#EXT-X-ENDLIST')
+    return '\n'.join(lines) + '\n'
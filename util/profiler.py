@@ -0,0 +1,161 @@
+import re
+import sys
+import time
+import logging
+import threading
+from collections import Counter
+
+from util.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+# Frames kept per sample, from the thread's entry point down
+MAX_DEPTH = 96
+
+# Longest run accepted (seconds)
+MAX_DURATION = 300
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler that can be switched on in a running process.
+
+    While running, a daemon thread reads every other thread's Python stack
+    (sys._current_frames) every `interval` seconds and counts identical stacks.
+    Samples are wall-clock: a thread blocked in a socket read is counted in the
+    frame that made the call, so I/O waits show up next to CPU-bound frames.
+
+    Stacks are rooted at the Flask endpoint the thread is serving (see
+    tag_thread), or at the thread's name for worker threads, and exported in
+    the collapsed format flamegraph.pl and speedscope read:
+        stream_proxy;threading.Thread._bootstrap;...;util.streaming._relay 42
+    """
+
+    def __init__(self):
+        self._tags = {}  # { thread ident: endpoint }
+        self._labels = {}  # { (co_filename, co_firstlineno, co_name): "module.qualname" }, per run
+        self._stacks = Counter()
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._run = {}
+
+    # Tagging is always on: a stream relay started before the profiler must still be attributed
+    def tag_thread(self, endpoint):
+        self._tags[threading.get_ident()] = endpoint
+
+    def untag_thread(self, ident=None):
+        self._tags.pop(threading.get_ident() if ident is None else ident, None)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, duration=30, interval=0.01):
+        """
+        Starts sampling for `duration` seconds (capped at MAX_DURATION), discarding the previous run.
+
+        Returns:
+            bool: False if a run is already in progress.
+        """
+        with self._lock:
+            if self.running:
+                return False
+            duration = max(0.1, min(float(duration), MAX_DURATION))
+            interval = max(0.001, float(interval))
+            self._stacks = Counter()
+            self._labels = {}
+            self._stop.clear()
+            self._run = {
+                "started_at": time.time(),
+                "duration": duration,
+                "interval": interval,
+                "samples": 0,
+                "sampler_cpu_seconds": 0.0,
+            }
+            self._thread = threading.Thread(target=self._sample_loop, args=(duration, interval),
+                                            name="sampling-profiler", daemon=True)
+            self._thread.start()
+        METRICS.incr("profiler.runs")
+        log.info("Sampling profiler started for %.1fs every %.1fms", duration, interval * 1000)
+        return True
+
+    def stop(self):
+        """Ends the current run early; its samples stay available."""
+        self._stop.set()
+        thread = self._thread
+        if thread is not None:
+            thread.join(timeout=5)
+
+    def _sample_loop(self, duration, interval):
+        own_ident = threading.get_ident()
+        cpu_started = time.thread_time()
+        deadline = time.monotonic() + duration
+        while not self._stop.is_set() and time.monotonic() < deadline:
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            frames = sys._current_frames()
+            samples = Counter()
+            for ident, frame in frames.items():
+                if ident != own_ident:
+                    samples[self._collapse(ident, frame, names)] += 1
+            del frames
+            with self._lock:
+                self._stacks.update(samples)
+                self._run["samples"] += 1
+                self._run["sampler_cpu_seconds"] = time.thread_time() - cpu_started
+            self._stop.wait(interval)
+        with self._lock:
+            self._run["ended_at"] = time.time()
+        log.info("Sampling profiler stopped after %d samples", self._run["samples"])
+
+    def _collapse(self, ident, frame, names):
+        labels = []
+        while frame is not None and len(labels) < MAX_DEPTH:
+            code = frame.f_code
+            # Keyed by location rather than the code object, which would keep reloaded code alive
+            key = (code.co_filename, code.co_firstlineno, code.co_name)
+            label = self._labels.get(key)
+            if label is None:
+                module = frame.f_globals.get('__name__', '?')
+                name = getattr(code, 'co_qualname', code.co_name)  # co_qualname is Python 3.11+
+                label = self._labels[key] = f"{module}.{name}".replace(';', ':')
+            labels.append(label)
+            frame = frame.f_back
+        endpoint = self._tags.get(ident)
+        if endpoint is not None:
+            root = endpoint
+        else:
+            # Pool threads are numbered (stream-pipeline_3, Thread-12 (worker)), one root per pool
+            root = "thread:" + re.sub(r"[-_]?\d+", "", names.get(ident, "?"))
+        labels.append(root)
+        return ";".join(reversed(labels))
+
+    def collapsed(self, endpoint=None):
+        """
+        The samples of the current or last run in collapsed-stack format, heaviest first.
+
+        Args:
+            endpoint (str): Only stacks rooted at this endpoint (or thread:<name>).
+        """
+        with self._lock:
+            stacks = self._stacks.most_common()
+        lines = [f"{stack} {count}" for stack, count in stacks
+                 if endpoint is None or stack.split(";", 1)[0] == endpoint]
+        return "\n".join(lines) + "\n" if lines else ""
+
+    def stats(self):
+        """The run's settings and progress, with samples per root (endpoint or thread)."""
+        with self._lock:
+            roots = Counter()
+            for stack, count in self._stacks.items():
+                roots[stack.split(";", 1)[0]] += count
+            return {
+                "running": self.running,
+                **self._run,
+                "stacks": len(self._stacks),
+                "roots": dict(roots.most_common()),
+                "tagged_threads": len(self._tags),
+            }
+
+
+PROFILER = SamplingProfiler()
@@ -0,0 +1,182 @@
+import math
+import re
+import threading
+from collections import OrderedDict
+
+from util.metrics import METRICS
+
+# Beacon event codes sent by the player, and the series they feed
+EVENT_SERIES = {
+    "st": "startup_ms",        # time to first frame
+    "rb": "rebuffer_ms",       # one stall, from 'waiting' to 'playing'
+    "sw": "switch_kbps",       # one rendition switch, to this bitrate
+    "df": "dropped_permille",  # dropped frames per 1000 decoded, per beacon interval
+    "sl": "segment_load_ms",   # one segment download, request to last byte
+    "sf": "segment_ttfb_ms",   # one segment download, request to first byte
+}
+
+# Rendition labels as the player builds them (smallest video dimension), anything else is pooled
+RENDITION_PATTERN = re.compile(r"^\d{2,4}p$")
+
+MAX_EVENTS_PER_BEACON = 500
+MAX_VALUE = 3600 * 1000
+
+
+class LogHistogram:
+    """
+    Streaming quantile sketch: values are counted in logarithmic buckets, so
+    any quantile is known within `relative_accuracy` and memory is bounded by
+    the bucket count for [1, max_value], however many values are recorded.
+    """
+
+    def __init__(self, relative_accuracy=0.02, max_value=MAX_VALUE):
+        self._gamma = (1 + relative_accuracy) / (1 - relative_accuracy)
+        self._log_gamma = math.log(self._gamma)
+        self._max_index = int(math.ceil(math.log(max_value) / self._log_gamma)) + 1
+        self._buckets = {}  # { bucket index: count }, at most _max_index + 1 keys
+        self.count = 0
+        self.total = 0.0
+        self.min = math.inf
+        self.max = 0.0
+
+    def _index(self, value):
+        # Bucket 0 holds everything below 1 (sub-millisecond times, zero counts)
+        if value < 1:
+            return 0
+        return min(int(math.ceil(math.log(value) / self._log_gamma)) + 1, self._max_index)
+
+    def record(self, value):
+        index = self._index(value)
+        self._buckets[index] = self._buckets.get(index, 0) + 1
+        self.count += 1
+        self.total += value
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+    def quantile(self, q):
+        """Returns the q quantile (0-1), or None when empty."""
+        if not self.count:
+            return None
+        rank = q * (self.count - 1)
+        seen = 0
+        for index in sorted(self._buckets):
+            seen += self._buckets[index]
+            if seen > rank:
+                if index == 0:
+                    return self.min
+                # Midpoint of the bucket (gamma^(i-2), gamma^(i-1)], in relative terms
+                estimate = 2 * self._gamma ** (index - 1) / (self._gamma + 1)
+                return min(self.max, max(self.min, estimate))
+        return self.max
+
+    def summary(self):
+        return {
+            "count": self.count,
+            "mean": round(self.total / self.count, 1) if self.count else None,
+            "p50": _round(self.quantile(0.5)),
+            "p90": _round(self.quantile(0.9)),
+            "p99": _round(self.quantile(0.99)),
+            "max": _round(self.max) if self.count else None,
+        }
+
+
+def _round(value):
+    return None if value is None else round(value, 1)
+
+
+class QoeAggregator:
+    """
+    Playback quality reported by players (hls.js events), aggregated in memory
+    per post and per rendition into one LogHistogram per series.
+
+    Memory is bounded: a fixed set of series per key, at most `max_posts` posts
+    (least recently reported evicted first) and `max_renditions` renditions.
+    """
+
+    def __init__(self, max_posts=256, max_renditions=16):
+        self.max_posts = max_posts
+        self.max_renditions = max_renditions
+        self._overall = {}
+        self._posts = OrderedDict()  # { post_id: { series: LogHistogram } }
+        self._renditions = {}  # { rendition: { series: LogHistogram } }
+        self._lock = threading.Lock()
+
+    def ingest(self, post_id, events):
+        """
+        Records a beacon's events.
+
+        Args:
+            post_id (int): The post that was played.
+            events (list): [code, rendition, value] triples, code from EVENT_SERIES.
+
+        Returns:
+            int: The number of events recorded (malformed ones are skipped).
+        """
+        recorded = 0
+        with self._lock:
+            post = self._posts.get(post_id)
+            if post is None:
+                post = self._posts[post_id] = {}
+                while len(self._posts) > self.max_posts:
+                    self._posts.popitem(last=False)
+            self._posts.move_to_end(post_id)
+
+            for event in events[:MAX_EVENTS_PER_BEACON]:
+                try:
+                    code, rendition, value = event
+                    series = EVENT_SERIES[code]
+                    value = float(value)
+                except (TypeError, ValueError, KeyError):
+                    continue
+                if not 0 <= value <= MAX_VALUE:
+                    continue
+                rendition = rendition if isinstance(rendition, str) and RENDITION_PATTERN.match(rendition) else "other"
+                by_rendition = self._renditions.get(rendition)
+                if by_rendition is None:
+                    if len(self._renditions) >= self.max_renditions:
+                        rendition = "other"
+                    by_rendition = self._renditions.setdefault(rendition, {})
+                for target in (self._overall, post, by_rendition):
+                    histogram = target.get(series)
+                    if histogram is None:
+                        histogram = target[series] = LogHistogram()
+                    histogram.record(value)
+                recorded += 1
+
+        METRICS.incr("qoe.beacons")
+        METRICS.incr("qoe.events", recorded)
+        return recorded
+
+    @staticmethod
+    def _summaries(series):
+        return {name: histogram.summary() for name, histogram in sorted(series.items())}
+
+    def stats(self):
+        """Overall and per-rendition percentiles, for /api/metrics."""
+        with self._lock:
+            return {
+                "overall": self._summaries(self._overall),
+                "renditions": {rendition: self._summaries(series)
+                               for rendition, series in sorted(self._renditions.items())},
+                "posts": len(self._posts),
+            }
+
+    def size(self):
+        """Series counts, for /admin/diagnostics."""
+        with self._lock:
+            return {
+                "posts": len(self._posts),
+                "max_posts": self.max_posts,
+                "renditions": len(self._renditions),
+                "histograms": sum(len(series) for series in (self._overall, *self._posts.values(),
+                                                             *self._renditions.values())),
+            }
+
+    def post_stats(self):
+        """Percentiles per post, most recently reported first."""
+        with self._lock:
+            return {str(post_id): self._summaries(series) for post_id, series in reversed(self._posts.items())}
+
+
+QOE = QoeAggregator()
+METRICS.register_provider("qoe", QOE.stats)
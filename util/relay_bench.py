@@ -0,0 +1,100 @@
+"""
+CPU cost of relaying upstream bodies, before (iter_content with 8 KiB chunks)
+and after (iter_raw_chunks into pooled buffers).
+
+A local HTTP/1.1 server in a child process serves a segment-sized body; only the
+relaying process's CPU time is measured.
+
+    python -m util.relay_bench [--size-mb 2] [--requests 200]
+"""
+import time
+import argparse
+import multiprocessing
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import requests
+
+from util.upstream import iter_raw_chunks
+
+
+def _serve(port, body, ready):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+
+        def do_GET(self):
+            self.send_response(200)
+            self.send_header("Content-Type", "video/mp2t")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    ready.set()
+    server.serve_forever()
+
+
+def relay_iter_content(response):
+    chunks = 0
+    for chunk in response.iter_content(chunk_size=8192):
+        chunks += 1
+    return chunks
+
+
+def relay_raw(response):
+    chunks = 0
+    for chunk in iter_raw_chunks(response):
+        bytes(chunk)  # the copy handed to WSGI
+        chunks += 1
+    return chunks
+
+
+def measure(session, url, relay, requests_count):
+    cpu_started, wall_started = time.process_time(), time.perf_counter()
+    received = chunks = 0
+    for _ in range(requests_count):
+        response = session.get(url, stream=True)
+        try:
+            chunks += relay(response)
+            received += int(response.headers["Content-Length"])
+        finally:
+            response.close()
+    cpu = time.process_time() - cpu_started
+    wall = time.perf_counter() - wall_started
+    gigabytes = received / 1e9
+    return {
+        "cpu_s_per_gb": cpu / gigabytes,
+        "wall_s_per_gb": wall / gigabytes,
+        "chunks_per_request": chunks / requests_count,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size-mb", type=float, default=2)
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--port", type=int, default=8799)
+    args = parser.parse_args()
+
+    body = bytes(int(args.size_mb * 1024 * 1024))
+    ready = multiprocessing.Event()
+    server = multiprocessing.Process(target=_serve, args=(args.port, body, ready), daemon=True)
+    server.start()
+    ready.wait(10)
+    url = f"http://127.0.0.1:{args.port}/segment.ts"
+
+    try:
+        with requests.Session() as session:
+            for name, relay in (("iter_content(8192)", relay_iter_content), ("iter_raw_chunks", relay_raw)):
+                measure(session, url, relay, 5)  # warm the connection and caches
+                result = measure(session, url, relay, args.requests)
+                print(f"{name:20} {result['cpu_s_per_gb']:7.3f} CPU s/GB  {result['wall_s_per_gb']:7.3f} wall s/GB  "
+                      f"{result['chunks_per_request']:7.1f} chunks/request")
+    finally:
+        server.terminate()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,234 @@
+import os
+import time
+import heapq
+import itertools
+import logging
+import threading
+
+from util.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+# Lower value = served first
+PRIORITY_PLAYBACK = 0
+PRIORITY_PREFETCH = 1
+
+
+class AdmissionRejected(Exception):
+    """Raised when a transfer could not get an upstream slot before its deadline."""
+    pass
+
+
+# Longest sleep between two checks of an interruptible throttle wait (seconds)
+THROTTLE_CHECK_SECONDS = 0.02
+
+
+class TokenBucket:
+    """
+    Byte-rate limiter. consume() blocks the calling thread until the bytes fit.
+    """
+
+    def __init__(self, rate, burst):
+        self.rate = float(rate)
+        self.burst = float(burst)
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.last_used = self.updated
+        self._lock = threading.Lock()
+
+    def _reserve(self, amount):
+        """Takes amount tokens (possibly going negative) and returns how long to wait for them."""
+        with self._lock:
+            now = time.monotonic()
+            self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.last_used = now
+            self.tokens -= amount
+            if self.tokens >= 0:
+                return 0.0
+            return -self.tokens / self.rate
+
+    def consume(self, amount, interrupted=None):
+        """
+        Waits until amount bytes fit. With `interrupted`, a callable checked every
+        THROTTLE_CHECK_SECONDS, the wait ends early once it returns True.
+
+        Returns:
+            float: The seconds waited.
+        """
+        wait = self._reserve(amount)
+        if wait <= 0:
+            return 0.0
+        if interrupted is None:
+            time.sleep(wait)
+            return wait
+        deadline = time.monotonic() + wait
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return wait
+            time.sleep(min(remaining, THROTTLE_CHECK_SECONDS))
+            if interrupted():
+                return wait - max(0.0, deadline - time.monotonic())
+
+
+class AdmissionTicket:
+    """A granted upstream slot. release() is idempotent."""
+
+    def __init__(self, scheduler):
+        self._scheduler = scheduler
+        self._released = False
+
+    def release(self):
+        if not self._released:
+            self._released = True
+            self._scheduler._release()
+
+
+class StreamScheduler:
+    """
+    Admission control and fair-share egress for the stream proxy.
+
+    - at most max_transfers upstream transfers run at once, the rest wait in a
+      priority queue (playback before prefetch, then FIFO) until queue_timeout
+    - every relayed chunk is charged to a per-tab and a per-user token bucket,
+      so one tab (or one download manager) cannot take the whole uplink
+    """
+
+    def __init__(
+        self,
+        max_transfers=16,
+        queue_timeout=10.0,
+        tab_rate=8 * 1024 * 1024,
+        tab_burst=4 * 1024 * 1024,
+        user_rate=16 * 1024 * 1024,
+        user_burst=8 * 1024 * 1024,
+        bucket_idle_seconds=600
+    ):
+        self.max_transfers = max_transfers
+        self.queue_timeout = queue_timeout
+        self.tab_rate, self.tab_burst = tab_rate, tab_burst
+        self.user_rate, self.user_burst = user_rate, user_burst
+        self.bucket_idle_seconds = bucket_idle_seconds
+
+        self.active = 0
+        self._waiters = []  # heap of (priority, seq, event)
+        self._seq = itertools.count()
+        self._lock = threading.Lock()
+
+        self._tab_buckets = {}
+        self._user_buckets = {}
+        self._buckets_lock = threading.Lock()
+        self._last_prune = time.monotonic()
+
+    # --- Admission ---
+
+    def admit(self, priority=PRIORITY_PLAYBACK, timeout=None):
+        """
+        Waits for an upstream slot.
+
+        Returns:
+            AdmissionTicket: to release once the upstream transfer is over.
+        Raises:
+            AdmissionRejected: if no slot was freed before the deadline.
+        """
+        timeout = self.queue_timeout if timeout is None else timeout
+        with self._lock:
+            if self.active < self.max_transfers and not self._waiters:
+                self.active += 1
+                self._update_gauges()
+                return AdmissionTicket(self)
+            event = threading.Event()
+            entry = (priority, next(self._seq), event)
+            heapq.heappush(self._waiters, entry)
+            self._update_gauges()
+
+        queued_at = time.monotonic()
+        if not event.wait(timeout):
+            with self._lock:
+                if not event.is_set():
+                    # Still queued: leave the queue and give up
+                    self._waiters.remove(entry)
+                    heapq.heapify(self._waiters)
+                    self._update_gauges()
+                    METRICS.incr("scheduler.rejected")
+                    raise AdmissionRejected(f"No upstream slot within {timeout}s")
+        METRICS.incr("scheduler.queued_seconds", time.monotonic() - queued_at)
+        return AdmissionTicket(self)
+
+    def _release(self):
+        with self._lock:
+            if self._waiters:
+                # Hand the slot over directly, active count stays the same
+                _, _, event = heapq.heappop(self._waiters)
+                event.set()
+            else:
+                self.active -= 1
+            self._update_gauges()
+
+    def _update_gauges(self):
+        METRICS.set_gauge("scheduler.active", self.active)
+        METRICS.set_gauge("scheduler.queued", len(self._waiters))
+
+    # --- Egress ---
+
+    def _bucket(self, buckets, key, rate, burst):
+        bucket = buckets.get(key)
+        if bucket is None:
+            with self._buckets_lock:
+                bucket = buckets.setdefault(key, TokenBucket(rate, burst))
+        return bucket
+
+    def throttle(self, tab_id, user_id, amount, interrupted=None):
+        """
+        Blocks until amount bytes may be sent to this tab and user.
+
+        Args:
+            interrupted (callable): Checked while waiting, ends the wait once it returns True
+                (the client went away).
+        """
+        self._prune_buckets()
+        waited = 0.0
+        if tab_id:
+            waited += self._bucket(self._tab_buckets, tab_id, self.tab_rate, self.tab_burst).consume(
+                amount, interrupted)
+        if user_id:
+            waited += self._bucket(self._user_buckets, user_id, self.user_rate, self.user_burst).consume(
+                amount, interrupted)
+        if waited:
+            METRICS.incr("scheduler.throttled")
+            METRICS.incr("scheduler.throttled_seconds", waited)
+
+    def _prune_buckets(self):
+        now = time.monotonic()
+        if now - self._last_prune < 60:
+            return
+        self._last_prune = now
+        with self._buckets_lock:
+            for buckets in (self._tab_buckets, self._user_buckets):
+                for key in [k for k, b in buckets.items() if now - b.last_used > self.bucket_idle_seconds]:
+                    del buckets[key]
+
+    def stats(self):
+        return {
+            "active": self.active,
+            "queued": len(self._waiters),
+            "max_transfers": self.max_transfers,
+            "tabs": len(self._tab_buckets),
+            "users": len(self._user_buckets),
+        }
+
+
+# Concurrent upstream transfers, seconds a transfer may wait for a slot, and egress rates in
+# bytes per second per tab and per user (bursts of half a second at that rate)
+TAB_RATE = int(os.environ.get('FROMM_TAB_RATE', 8 * 1024 * 1024))
+USER_RATE = int(os.environ.get('FROMM_USER_RATE', 16 * 1024 * 1024))
+SCHEDULER = StreamScheduler(
+    max_transfers=int(os.environ.get('FROMM_MAX_TRANSFERS', 16)),
+    queue_timeout=float(os.environ.get('FROMM_QUEUE_TIMEOUT', 10)),
+    tab_rate=TAB_RATE,
+    tab_burst=TAB_RATE // 2,
+    user_rate=USER_RATE,
+    user_burst=USER_RATE // 2
+)
+METRICS.register_provider("scheduler", SCHEDULER.stats)
@@ -0,0 +1,182 @@
+import os
+import json
+import time
+import struct
+import logging
+import threading
+
+from util.metrics import METRICS
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"FRMSNAP\0"
+VERSION = 1
+
+# magic, format version, creation time (epoch seconds)
+HEADER = struct.Struct(">8sHd")
+# section name length; the name, a JSON meta and a raw body follow, each length-prefixed
+SECTION_LENGTH = struct.Struct(">B")
+BLOCK_LENGTH = struct.Struct(">I")
+
+
+class SnapshotStore:
+    """
+    Persists in-process caches to one local file so a restart starts warm.
+
+    Every cache registers a section with a dump function yielding (meta, body)
+    records - meta is JSON-serializable, body is bytes - and a restore function
+    called with (meta, body, created_at) for each record read back. Restore
+    functions decide themselves which entries have expired.
+
+    A section may also register a version function returning a cheap value
+    that changes whenever its content does; periodic saves are skipped while
+    every section reports the version it had at the last save. The file holds
+    credentials and tokens, so it is only readable by its owner.
+
+    File layout (version 1), all integers big-endian:
+        header  = "FRMSNAP\\0" | u16 version | f64 created_at
+        record  = u8 len | section name | u32 len | meta JSON | u32 len | body
+        trailer = u8 0
+    A snapshot with another version is ignored; a truncated one is read up to the damage.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._sections = {}  # { name: (dump, restore) }
+        self._versions = {}  # { name: version function }
+        self._saved_versions = None
+        self._save_lock = threading.Lock()
+        self._timer = None
+
+    @property
+    def enabled(self):
+        return bool(self.path)
+
+    def register(self, name, dump, restore, version=None):
+        if len(name.encode('utf-8')) > 255:
+            raise ValueError(f"Section name too long: {name}")
+        self._sections[name] = (dump, restore)
+        if version is not None:
+            self._versions[name] = version
+
+    def _current_versions(self):
+        """The version of every section, or None if a section has no version function."""
+        if self._versions.keys() != self._sections.keys():
+            return None
+        return {name: version() for name, version in self._versions.items()}
+
+    def save(self, only_if_changed=False):
+        """
+        Writes all registered sections, replacing the previous snapshot atomically.
+
+        Args:
+            only_if_changed (bool): Skip the write if no section changed since the last save.
+        """
+        if not self.enabled:
+            return
+        with self._save_lock:
+            versions = self._current_versions()
+            if only_if_changed and versions is not None and versions == self._saved_versions:
+                METRICS.incr("snapshot.unchanged")
+                log.debug("Snapshot skipped: no section changed")
+                return
+            started = time.monotonic()
+            tmp_path = f"{self.path}.part"
+            records = 0
+            try:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                # A leftover .part keeps its mode through O_CREAT, start from a new file
+                try:
+                    os.unlink(tmp_path)
+                except FileNotFoundError:
+                    pass
+                with os.fdopen(os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600), "wb") as f:
+                    f.write(HEADER.pack(MAGIC, VERSION, time.time()))
+                    for name, (dump, _) in list(self._sections.items()):
+                        encoded_name = name.encode('utf-8')
+                        try:
+                            for meta, body in dump():
+                                meta_bytes = json.dumps(meta, separators=(',', ':')).encode('utf-8')
+                                f.write(SECTION_LENGTH.pack(len(encoded_name)))
+                                f.write(encoded_name)
+                                f.write(BLOCK_LENGTH.pack(len(meta_bytes)))
+                                f.write(meta_bytes)
+                                f.write(BLOCK_LENGTH.pack(len(body)))
+                                f.write(body)
+                                records += 1
+                        except Exception as e:
+                            log.warning("Snapshot section %s skipped: %s", name, e)
+                    f.write(SECTION_LENGTH.pack(0))
+                os.replace(tmp_path, self.path)
+            except OSError as e:
+                log.warning("Could not write snapshot %s: %s", self.path, e)
+                return
+            self._saved_versions = versions
+            METRICS.incr("snapshot.saved")
+            log.info("Snapshot of %d entries written in %.2fs", records, time.monotonic() - started)
+
+    def load(self):
+        """Reads the snapshot back record by record. Returns the number of records restored."""
+        if not self.enabled:
+            return 0
+        restored = 0
+        try:
+            with open(self.path, "rb") as f:
+                header = f.read(HEADER.size)
+                if len(header) < HEADER.size:
+                    return 0
+                magic, version, created_at = HEADER.unpack(header)
+                if magic != MAGIC or version != VERSION:
+                    log.warning("Ignoring snapshot %s: unsupported format", self.path)
+                    return 0
+                for name, meta, body in self._records(f):
+                    section = self._sections.get(name)
+                    if section is None:
+                        continue
+                    try:
+                        if section[1](meta, body, created_at):
+                            restored += 1
+                    except Exception as e:
+                        log.debug("Snapshot record of %s not restored: %s", name, e)
+        except FileNotFoundError:
+            return 0
+        except (OSError, ValueError, struct.error) as e:
+            log.warning("Snapshot %s partly unreadable: %s", self.path, e)
+        METRICS.incr("snapshot.restored", restored)
+        log.info("Restored %d entries from snapshot", restored)
+        return restored
+
+    def _records(self, f):
+        while True:
+            name_length = f.read(SECTION_LENGTH.size)
+            if not name_length or not name_length[0]:
+                return
+            name = _read_exactly(f, name_length[0]).decode('utf-8')
+            meta = json.loads(_read_exactly(f, BLOCK_LENGTH.unpack(_read_exactly(f, BLOCK_LENGTH.size))[0]))
+            body = _read_exactly(f, BLOCK_LENGTH.unpack(_read_exactly(f, BLOCK_LENGTH.size))[0])
+            yield name, meta, body
+
+    def load_in_background(self):
+        """Restores the snapshot on a daemon thread so startup never waits for it."""
+        if self.enabled:
+            threading.Thread(target=self.load, name="snapshot-load", daemon=True).start()
+
+    def save_every(self, interval):
+        """Saves a snapshot every `interval` seconds on a daemon timer (0 disables)."""
+        if not self.enabled or interval <= 0:
+            return
+
+        def tick():
+            self.save(only_if_changed=True)
+            self.save_every(interval)
+
+        self._timer = threading.Timer(interval, tick)
+        self._timer.daemon = True
+        self._timer.start()
+
+
+def _read_exactly(f, size):
+    data = f.read(size)
+    if len(data) != size:
+        raise ValueError("Truncated snapshot record")
+    return data
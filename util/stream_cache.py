@@ -0,0 +1,133 @@
+import time
+import threading
+from collections import OrderedDict, namedtuple
+
+from util.metrics import METRICS
+
+CachedBody = namedtuple("CachedBody", ["content", "content_type", "expires_at"])
+
+
+class StreamCache:
+    """
+    Byte-bounded LRU of upstream bodies (playlists and segments), keyed by (post_id, video_path).
+
+    Fetches can be announced with begin() so a player request arriving while a
+    prefetch of the same resource is in flight waits for it instead of
+    starting a second upstream download.
+    """
+
+    def __init__(self, max_bytes=256 * 1024 * 1024, max_entry_bytes=16 * 1024 * 1024, ttl=120):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self.size = 0
+        self._generation = 0  # bumped on every change, see SnapshotStore versions
+        self._entries = OrderedDict()
+        self._in_flight = {}  # { key: threading.Event }
+        self._lock = threading.Lock()
+
+    def get(self, key, wait=0):
+        """
+        Returns the cached body for key, or None.
+
+        Args:
+            key (tuple): (post_id, video_path)
+            wait (float): seconds to wait for an in-flight fetch of the same key.
+        """
+        with self._lock:
+            entry = self._lookup(key)
+            event = self._in_flight.get(key) if entry is None else None
+        if event is not None and wait > 0 and event.wait(wait):
+            with self._lock:
+                entry = self._lookup(key)
+        METRICS.incr("stream_cache.hits" if entry else "stream_cache.misses")
+        return entry
+
+    def _lookup(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry.expires_at < time.monotonic():
+            self._remove(key)
+            return None
+        self._entries.move_to_end(key)
+        return entry
+
+    def begin(self, key):
+        """Marks key as being fetched. Returns False if it is already cached or in flight."""
+        with self._lock:
+            if key in self._in_flight or self._lookup(key) is not None:
+                return False
+            self._in_flight[key] = threading.Event()
+            return True
+
+    def put(self, key, content, content_type, ttl=None):
+        if len(content) <= self.max_entry_bytes:
+            expires_at = time.monotonic() + (ttl or self.ttl)
+            with self._lock:
+                self._remove(key)
+                self._entries[key] = CachedBody(content, content_type, expires_at)
+                self.size += len(content)
+                self._generation += 1
+                while self.size > self.max_bytes and self._entries:
+                    self._remove(next(iter(self._entries)))
+        self._finish(key)
+
+    def abandon(self, key):
+        """Ends an in-flight fetch that produced nothing."""
+        self._finish(key)
+
+    def _finish(self, key):
+        with self._lock:
+            event = self._in_flight.pop(key, None)
+        if event is not None:
+            event.set()
+
+    def _remove(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self.size -= len(entry.content)
+            self._generation += 1
+
+    def export(self):
+        """
+        Yields (meta, body) snapshot records of the unexpired entries, expiry as wall-clock time.
+        """
+        with self._lock:
+            entries = list(self._entries.items())
+        now, wall_now = time.monotonic(), time.time()
+        for (post_id, video_path), entry in entries:
+            if entry.expires_at > now:
+                meta = {
+                    "key": [post_id, video_path],
+                    "content_type": entry.content_type,
+                    "expires_at": wall_now + entry.expires_at - now,
+                }
+                yield meta, entry.content
+
+    def version(self):
+        return self._generation
+
+    def restore(self, meta, body, created_at=None):
+        """Puts back a snapshot record unless it expired or the key was cached since. Returns True if restored."""
+        ttl = meta["expires_at"] - time.time()
+        key = tuple(meta["key"])
+        if ttl <= 0:
+            return False
+        with self._lock:
+            if key in self._in_flight or self._lookup(key) is not None:
+                return False
+        self.put(key, body, meta["content_type"], ttl=ttl)
+        return True
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "bytes": self.size,
+            "max_bytes": self.max_bytes,
+            "in_flight": len(self._in_flight),
+        }
+
+
+STREAM_CACHE = StreamCache()
+METRICS.register_provider("stream_cache", STREAM_CACHE.stats)
@@ -1,8 +1,57 @@
 import requests
 import os
 import re
+import json
+import base64
 import logging
-from flask import Response
+import posixpath
+import select
+import socket
+import ssl
+import threading
+from collections import deque
+from itertools import islice
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from urllib.parse import urlsplit, unquote
+from flask import Response, request, has_request_context
+
+from util.archive import serve_archived_file
+from util.upstream import UPSTREAM, iter_raw_chunks
+from util.scheduler import SCHEDULER, PRIORITY_PLAYBACK, PRIORITY_PREFETCH
+from util.metrics import METRICS
+from util.playlist import (
+    NO_POLICY, Variant, is_master_playlist, parse_master_playlist, select_variants, render_master_playlist,
+    can_group_segments, group_media_playlist, parse_media_playlist, parse_virtual_segment_path,
+    parse_iframe_playlist_path, render_iframe_playlist
+)
+from util.stream_cache import STREAM_CACHE
+from util.keyframes import KEYFRAMES
+from util.mpegts import KeyframeScanner
+from util.diagnostics import LIVE
+
+# How long a player request waits for a warm-up fetch of the same resource already in flight
+CACHE_WAIT_SECONDS = 5
+
+# Number of leading segments fetched when warming a post
+WARM_SEGMENTS = 2
+
+# Upstream segments downloaded ahead of the one being sent, for virtual segments
+PIPELINE_DEPTH = 2
+
+# How long raw media playlists stay cached for virtual segment lookups
+PLAYLIST_TTL = 600
+
+# Bytes fetched from the start of a segment to index its first keyframe(s), and
+# segments queued for that per I-frame playlist request
+INDEX_PREFIX_BYTES = 256 * 1024
+INDEX_BATCH = 32
+
+_warm_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="warm")
+_pipeline_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="pipeline")
+_index_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="keyframes")
+_indexing = set()
+_indexing_lock = threading.Lock()
 
 
 def extract_video_credentials(post_infos):
@@ -20,7 +69,7 @@ def extract_video_credentials(post_infos):
         logging.error("URL key not found in post data.")
         return None
 
-    logging.info(f"Found URL: {url[:150]}...")
+    logging.debug("Found URL: %.150s...", url)
 
     pattern = r"CloudFront-Key-Pair-Id=([^&]+)&CloudFront-Signature=([^&]+)&CloudFront-Policy=([^&]+)"
     match = re.search(pattern, url)
@@ -31,9 +80,9 @@ def extract_video_credentials(post_infos):
             "signature": match.group(2),
             "policy": match.group(3)
         }
-        logging.info("✅ Successfully extracted video stream credentials.")
+        logging.debug("✅ Successfully extracted video stream credentials.")
 
-        logging.info("Extracting m3u8 master url.")
+        logging.debug("Extracting m3u8 master url.")
         match = re.search(r"\S+\.m3u8", url)
         post_infos['url'] = url
 
@@ -41,7 +90,7 @@ def extract_video_credentials(post_infos):
             base_split = match.group().split("_")
             master_url = f"{"_".join(base_split[:-1])}.{base_split[-1].split(".")[-1]}"
             post_infos['master_url']=master_url
-            logging.info(f"extracted master playlist url {master_url}")
+            logging.debug("extracted master playlist url %s", master_url)
 
             # Return both the credentials and the full post data
             return {"creds": creds, "post_data": post_infos}
@@ -50,35 +99,133 @@ def extract_video_credentials(post_infos):
         return None
 
 
-def proxy_stream_request(post_id, video_path, stream_credentials, content_host, user_agent_string, device_info):
+def cloudfront_policy_expiry(policy):
     """
-    Proxies a request for an HLS segment (.ts) or playlist (.m3u8).
-    Rewrites URLs in playlists to point back to this proxy.
+    Args:
+        policy (str): The CloudFront-Policy value of the credentials (CloudFront-safe base64 of a JSON policy).
+
+    Returns:
+        float: The epoch time the signed policy stops being valid, or None if it cannot be read.
+    """
+    try:
+        encoded = unquote(policy).translate(str.maketrans("-_~", "+=/"))
+        statements = json.loads(base64.b64decode(encoded))["Statement"]
+        return min(statement["Condition"]["DateLessThan"]["AWS:EpochTime"] for statement in statements)
+    except (ValueError, KeyError, TypeError):
+        return None
 
-    If you read this, a small change can make you stream in 1080p lol
+
+def rewrite_playlist(original_content, post_id, video_path, rendition_policy=NO_POLICY, segment_group=1,
+                     iframe_playlists=False):
+    """
+    Rewrites every URI line of a playlist to point back to this proxy.
+    Master playlists also get the rendition policy applied, media playlists
+    get their segments grouped into virtual segments when segment_group > 1.
 
     Args:
+        original_content (str): The playlist as returned by the content host.
         post_id (int): The post_id, used for rewriting the proxy URL.
-        video_path (str): The path to the video resource (e.g., 'hls/1080p/video.m3u8').
-        stream_credentials (dict): A dict with 'CloudFront-Key-Pair-Id', 'CloudFront-Signature', 'CloudFront-Policy'.
-        content_host (str): The hostname of the content server.
-        user_agent_string: The user agent to use
-        device_info(dict): Dictionary of the device info
+        video_path (str): The path of the playlist, URIs are resolved relative to it.
+        rendition_policy (RenditionPolicy): Variant caps/ordering for master playlists.
+        segment_group (int): Number of upstream segments per virtual segment, 1 to disable.
+        iframe_playlists (bool): List proxy-generated I-frame playlists in master playlists.
     Returns:
-        flask.Response: A Flask Response object, either streaming content or a rewritten playlist.
+        str: The rewritten playlist.
     """
-    real_url = f"https://{content_host}/{video_path}"
+    if is_master_playlist(original_content):
+        return _rewrite_master_playlist(original_content, post_id, video_path, rendition_policy, iframe_playlists)
+    if segment_group > 1 and can_group_segments(original_content):
+        return _rewrite_grouped_playlist(original_content, post_id, video_path, segment_group)
+    return _rewrite_uris(original_content, post_id, video_path)
+
+
+@lru_cache(maxsize=16)
+def _rewrite_grouped_playlist(original_content, post_id, video_path, segment_group):
+    grouped = group_media_playlist(original_content, posixpath.basename(video_path), segment_group)
+    return _rewrite_uris(grouped, post_id, video_path)
+
+
+@lru_cache(maxsize=256)
+def _rewrite_master_playlist(original_content, post_id, video_path, rendition_policy, iframe_playlists):
+    # Master playlists are tiny and requested once per playback: memoize the final text per policy
+    if iframe_playlists or not rendition_policy.is_empty():
+        original_content = render_master_playlist(original_content, rendition_policy, iframe_playlists)
+    return _rewrite_uris(original_content, post_id, video_path)
+
+
+def rewrite_cache_stats():
+    return {
+        "master": _rewrite_master_playlist.cache_info()._asdict(),
+        "grouped": _rewrite_grouped_playlist.cache_info()._asdict(),
+    }
+
+
+def _rewrite_uris(original_content, post_id, video_path):
+    base_path = os.path.dirname(video_path.lstrip('/'))
+    if base_path:
+        proxy_prefix = f"/stream/p{post_id}/{base_path}/"
+    else:
+        proxy_prefix = f"/stream/p{post_id}/"
+
+    proxy_prefix = re.sub(r'/+', '/', proxy_prefix)
+    replacement_string = f"{proxy_prefix}\\1"
+
+    rewritten_content = re.sub(
+        r'^(?!#)(.+)',
+        replacement_string,
+        original_content,
+        flags=re.MULTILINE
+    )
+
+    # Relative URI attributes of tags (I-frame playlists, keys, alternative renditions)
+    if 'URI="' in rewritten_content:
+        rewritten_content = re.sub(
+            r'URI="(?![a-zA-Z][a-zA-Z0-9+.-]*:|/)([^"]+)"',
+            f'URI="{proxy_prefix}\\1"',
+            rewritten_content
+        )
+    return rewritten_content
+
+
+def serve_archived_request(post_id, video_path, archive, rendition_policy=NO_POLICY):
+    """
+    Serves an HLS resource of a locally archived post, without touching the content host.
 
+    Playlists go through the same rewrite as proxied ones, everything else is
+    sent from disk through the WSGI file wrapper (zero-copy, Range support).
+
+    Args:
+        post_id (int): The post_id.
+        video_path (str): The path to the video resource.
+        archive (ArchiveIndex): The local archive index.
+        rendition_policy (RenditionPolicy): Variant caps/ordering for master playlists.
+    Returns:
+        flask.Response or None: None if the resource is not archived.
+    """
+    resolved = archive.resolve(post_id, video_path)
+    if not resolved:
+        return None
+    path, entry = resolved
+
+    if '.m3u8' in video_path:
+        with open(path, "r", encoding="utf-8") as f:
+            rewritten_content = rewrite_playlist(f.read(), post_id, video_path, rendition_policy)
+        return Response(rewritten_content, content_type='application/vnd.apple.mpegurl')
+
+    return serve_archived_file(path, entry)
+
+
+def build_upstream_headers(stream_credentials, content_host, user_agent_string, device_info):
+    """
+    Headers that mimic the Fromm app WebView, with the CloudFront cookies of the post.
+    """
     cookie_header_string = (
         f"CloudFront-Key-Pair-Id={stream_credentials['CloudFront-Key-Pair-Id']}; "
         f"CloudFront-Signature={stream_credentials['CloudFront-Signature']}; "
         f"CloudFront-Policy={stream_credentials['CloudFront-Policy']}"
     )
 
-    if '.m3u8' in video_path:
-        logging.info(f"Requesting playlist. Using Cookie: {cookie_header_string[:80]}...")
-
-    headers = {
+    return {
         "Accept": "*/*", "Accept-Encoding": "gzip, deflate, br, zstd",
         "Accept-Language": "fr-FR,fr;q=0.9,en-US;q=0.8,en;q=0.7", "Connection": "keep-alive",
         "Cookie": cookie_header_string, "Host": content_host, "Origin": "https://channel.frommyarti.com",
@@ -90,40 +237,489 @@ def proxy_stream_request(post_id, video_path, stream_credentials, content_host,
         "X-Requested-With": "com.knowmerce.fromm.fan"
     }
 
+
+class RelayAborted(Exception):
+    """A segment fetch dropped because the viewer of its relay went away."""
+    pass
+
+
+def _disconnect_probe():
+    """
+    Returns a function telling whether the current request's client has closed its
+    connection, or None when the server does not expose the socket (only the
+    werkzeug server does), it is TLS, where peeking is not possible, or the
+    platform has no poll().
+    """
+    sock = request.environ.get('werkzeug.socket') if has_request_context() else None
+    if sock is None or isinstance(sock, ssl.SSLSocket) or not hasattr(select, 'poll'):
+        return None
+    # poll() rather than select(), which cannot watch descriptors >= FD_SETSIZE (1024)
+    poller = select.poll()
+    poller.register(sock, select.POLLIN)
+
+    def disconnected():
+        try:
+            events = poller.poll(0)
+            if not events:
+                return False
+            # A client aborting with unread response data resets the connection
+            if events[0][1] & (select.POLLERR | select.POLLHUP):
+                return True
+            # Readable with nothing to read: the client sent FIN. Pipelined request bytes are not a disconnect.
+            return sock.recv(1, socket.MSG_PEEK) == b''
+        except (ConnectionResetError, BrokenPipeError):
+            return True
+        except (OSError, ValueError):
+            # Unknown: keep relaying, a gone client still fails the next write
+            return False
+    return disconnected
+
+
+class StreamBody:
+    """
+    Streaming response body wrapping a relay generator, with an explicit close().
+
+    The WSGI server calls close() when the response ends or the client goes away.
+    A generator's finally block only runs if iteration had started, so the cleanup
+    callables (closing the upstream response, releasing the slot, cancelling
+    prefetches) run from here in every case.
+
+    Every chunk is charged to the tab and user egress buckets here. The client
+    socket is probed before each chunk and while a chunk waits for its egress
+    budget, so a viewer who seeked away stops the upstream transfer right away
+    instead of at the next failed write.
+    """
+
+    def __init__(self, chunks, cleanup=(), expected_length=None, tab_id=None, user_id=None):
+        self._chunks = chunks
+        self._cleanup = cleanup
+        self._expected_length = expected_length
+        self._tab_id = tab_id
+        self._user_id = user_id
+        self._disconnected = _disconnect_probe()
+        self._closed = False
+        self._complete = False
+        self.sent = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self._closed or (self._disconnected is not None and self._disconnected()):
+            self.close()
+            raise StopIteration
+        try:
+            chunk = next(self._chunks)
+        except StopIteration:
+            self._complete = True
+            raise
+        if self._tab_id or self._user_id:
+            SCHEDULER.throttle(self._tab_id, self._user_id, len(chunk), self._disconnected)
+            if self._disconnected is not None and self._disconnected():
+                self.close()
+                raise StopIteration
+        self.sent += len(chunk)
+        return chunk
+
+    def close(self):
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            self._chunks.close()
+        finally:
+            for cleanup in self._cleanup:
+                cleanup()
+        if not self._complete:
+            METRICS.incr("stream.aborts")
+            METRICS.incr("stream.aborted_bytes_sent", self.sent)
+            if self._expected_length:
+                METRICS.incr("stream.aborted_bytes_skipped", max(0, self._expected_length - self.sent))
+
+
+def _relay_cached(content, chunk_size=65536, index_key=None):
+    """
+    Sends a body from the stream cache.
+    With index_key (post_id, video_path), the segment keyframes are indexed once it has been sent.
+    """
+    view = memoryview(content)
+    for offset in range(0, len(content), chunk_size):
+        yield bytes(view[offset:offset + chunk_size])
+    if index_key:
+        KEYFRAMES.scan_bytes(*index_key, content)
+
+
+def _relay(response, ticket, index_key=None):
+    """
+    Streams an upstream body to the client. The upstream slot and connection are
+    released when the client is done, including when it disconnects mid-segment.
+    With index_key (post_id, video_path), the segment keyframes are indexed on the way.
+
+    The body is read into a reused buffer in chunks sized to the upstream throughput
+    (see iter_raw_chunks); each chunk is copied once, into the bytes handed to WSGI.
+    An encoded body is relayed as received, its Content-Encoding is forwarded.
+    """
+    scanner = KEYFRAMES.observe(*index_key) if index_key else None
     try:
-        response = requests.get(real_url, headers=headers, stream=True)
-        response.raise_for_status()
+        with LIVE.active("stream_relays"):
+            for chunk in iter_raw_chunks(response, decode_content=False):
+                if scanner is not None:
+                    scanner.feed(chunk)
+                yield bytes(chunk)
+            if scanner is not None:
+                KEYFRAMES.finish(*index_key, scanner)
+    finally:
+        response.close()
+        ticket.release()
 
+
+def _fetch_segment(post_id, video_path, headers, content_host, cancelled=None):
+    """
+    Returns a whole upstream body, from the stream cache when possible.
+    Raises RelayAborted as soon as the `cancelled` event is set, closing the upstream response.
+    """
+    cached = STREAM_CACHE.get((post_id, video_path), wait=CACHE_WAIT_SECONDS)
+    if cached is not None:
+        return cached.content
+    if cancelled is not None and cancelled.is_set():
+        raise RelayAborted(video_path)
+    response = UPSTREAM.get(f"https://{content_host}/{video_path}", headers=headers, stream=True)
+    try:
+        body = bytearray()
+        for chunk in iter_raw_chunks(response):
+            if cancelled is not None and cancelled.is_set():
+                METRICS.incr("stream.aborted_prefetch_bytes", len(body))
+                raise RelayAborted(video_path)
+            body += chunk
+        return body
+    finally:
+        response.close()
+
+
+def _relay_pipelined(post_id, segment_paths, headers, content_host, ticket, cancelled, index_keyframes=False):
+    """
+    Streams several upstream segments back to back as one body.
+    The next PIPELINE_DEPTH segments are downloaded while the current one is sent;
+    setting `cancelled` stops the downloads in flight.
+    """
+    pending = deque()
+    remaining = iter(segment_paths)
+    try:
+        with LIVE.active("stream_relays"):
+            for path in islice(remaining, PIPELINE_DEPTH):
+                pending.append((path, _pipeline_executor.submit(
+                    _fetch_segment, post_id, path, headers, content_host, cancelled
+                )))
+            while pending:
+                path, future = pending.popleft()
+                content = future.result()
+                next_path = next(remaining, None)
+                if next_path is not None:
+                    pending.append((next_path, _pipeline_executor.submit(
+                        _fetch_segment, post_id, next_path, headers, content_host, cancelled
+                    )))
+                yield from _relay_cached(content, index_key=(post_id, path) if index_keyframes else None)
+    finally:
+        cancelled.set()
+        for _, future in pending:
+            future.cancel()
+        ticket.release()
+
+
+def _media_playlist_text(post_id, playlist_path, headers, content_host):
+    cached = STREAM_CACHE.get((post_id, playlist_path))
+    if cached is not None:
+        return cached.content.decode('utf-8')
+    response = UPSTREAM.get(f"https://{content_host}/{playlist_path}", headers=headers, stream=False)
+    STREAM_CACHE.put((post_id, playlist_path), response.content, 'application/vnd.apple.mpegurl', ttl=PLAYLIST_TTL)
+    return response.text
+
+
+def proxy_virtual_segment(post_id, playlist_path, start, count, headers, content_host,
+                          tab_id=None, user_id=None, priority=PRIORITY_PLAYBACK, index_keyframes=False):
+    """
+    Serves a virtual segment: `count` upstream segments of a media playlist, starting
+    at index `start`, concatenated into one MPEG-TS response.
+    With index_keyframes, the upstream segments are fed to the keyframe index.
+
+    Returns:
+        flask.Response: The concatenated segments, or a 404 if the range is not in the playlist.
+    """
+    playlist = parse_media_playlist(_media_playlist_text(post_id, playlist_path, headers, content_host))
+    segments = playlist.segments[start:start + count]
+    segment_paths = [_resolve_uri(playlist_path, segment.uri) for segment in segments]
+    if len(segment_paths) != count or None in segment_paths:
+        return Response("Unknown virtual segment", status=404)
+
+    METRICS.incr("stream.virtual_segments")
+    ticket = SCHEDULER.admit(priority)
+    cancelled = threading.Event()
+    return Response(
+        LIVE.track("stream_bodies", StreamBody(
+            _relay_pipelined(post_id, segment_paths, headers, content_host, ticket, cancelled, index_keyframes),
+            cleanup=(cancelled.set, ticket.release),
+            tab_id=tab_id,
+            user_id=user_id
+        )),
+        content_type='video/mp2t'
+    )
+
+
+def _index_segment_prefix(post_id, video_path, headers, content_host):
+    """Indexes the keyframes found in the first INDEX_PREFIX_BYTES of a segment (Range fetch)."""
+    ticket = None
+    try:
+        ticket = SCHEDULER.admit(PRIORITY_PREFETCH)
+        response = UPSTREAM.get(
+            f"https://{content_host}/{video_path}",
+            headers={**headers, "Range": f"bytes=0-{INDEX_PREFIX_BYTES - 1}"},
+            stream=False
+        )
+        scanner = KeyframeScanner()
+        scanner.feed(response.content)
+        if len(response.content) < INDEX_PREFIX_BYTES:
+            # The whole segment fit in the prefix
+            KEYFRAMES.finish(post_id, video_path, scanner)
+        elif scanner.valid:
+            # Only access units that ended inside the prefix are complete
+            KEYFRAMES.store(post_id, video_path, scanner.keyframes, len(response.content), complete=False)
+    except Exception as e:
+        logging.warning("Keyframe indexing of %s failed: %s", video_path, e)
+    finally:
+        if ticket is not None:
+            ticket.release()
+        with _indexing_lock:
+            _indexing.discard((post_id, video_path))
+
+
+def proxy_iframe_playlist(post_id, playlist_path, headers, content_host):
+    """
+    Serves the EXT-X-I-FRAMES-ONLY playlist of a media playlist, built from the keyframe index.
+    Segments not indexed yet are listed with a prefix byte range and queued for
+    background indexing, so the playlist gets more precise as it is requested again.
+    """
+    content = _media_playlist_text(post_id, playlist_path, headers, content_host)
+    playlist = parse_media_playlist(content)
+    segment_paths = [_resolve_uri(playlist_path, segment.uri) for segment in playlist.segments]
+    # From now on the post's relayed segments are indexed too
+    KEYFRAMES.load_post(post_id)
+    indexes = [KEYFRAMES.get(post_id, path) if path else None for path in segment_paths]
+
+    queued = 0
+    for path, entry in zip(segment_paths, indexes):
+        if queued >= INDEX_BATCH or not path or entry is not None:
+            continue
+        with _indexing_lock:
+            if (post_id, path) in _indexing:
+                continue
+            _indexing.add((post_id, path))
+        _index_executor.submit(_index_segment_prefix, post_id, path, headers, content_host)
+        queued += 1
+
+    iframe_playlist = render_iframe_playlist(content, indexes, INDEX_PREFIX_BYTES)
+    return Response(_rewrite_uris(iframe_playlist, post_id, playlist_path), content_type='application/vnd.apple.mpegurl')
+
+
+def proxy_stream_request(post_id, video_path, stream_credentials, content_host, user_agent_string, device_info,
+                         tab_id=None, user_id=None, priority=PRIORITY_PLAYBACK, rendition_policy=NO_POLICY,
+                         segment_group=1, iframe_playlists=False, byte_range=None):
+    """
+    Proxies a request for an HLS segment (.ts) or playlist (.m3u8).
+    Rewrites URLs in playlists to point back to this proxy.
+
+    If you read this, a small change can make you stream in 1080p lol
+
+    Args:
+        post_id (int): The post_id, used for rewriting the proxy URL.
+        video_path (str): The path to the video resource (e.g., 'hls/1080p/video.m3u8').
+        stream_credentials (dict): A dict with 'CloudFront-Key-Pair-Id', 'CloudFront-Signature', 'CloudFront-Policy'.
+        content_host (str): The hostname of the content server.
+        user_agent_string: The user agent to use
+        device_info(dict): Dictionary of the device info
+        tab_id (str): The browser tab, for fair-share egress.
+        user_id (str): The user, for fair-share egress.
+        priority (int): PRIORITY_PLAYBACK or PRIORITY_PREFETCH, used when waiting for an upstream slot.
+        rendition_policy (RenditionPolicy): Variant caps/ordering applied to the master playlist.
+        segment_group (int): Upstream segments per virtual segment in media playlists, 1 to disable.
+        iframe_playlists (bool): List proxy-generated I-frame playlists in master playlists, serve them
+            and index the keyframes of segments relayed for them.
+        byte_range (str): The client Range header, forwarded upstream for segments.
+    Returns:
+        flask.Response: A Flask Response object, either streaming content or a rewritten playlist.
+    Raises:
+        AdmissionRejected: if the upstream transfer could not be scheduled in time.
+    """
+    real_url = f"https://{content_host}/{video_path}"
+
+    virtual_segment = parse_virtual_segment_path(video_path)
+    if virtual_segment:
+        headers = build_upstream_headers(stream_credentials, content_host, user_agent_string, device_info)
+        return proxy_virtual_segment(post_id, *virtual_segment, headers, content_host,
+                                     tab_id=tab_id, user_id=user_id, priority=priority,
+                                     index_keyframes=iframe_playlists)
+
+    iframe_source = parse_iframe_playlist_path(video_path)
+    if iframe_source:
+        if not iframe_playlists:
+            return Response("I-frame playlists are disabled", status=404)
+        headers = build_upstream_headers(stream_credentials, content_host, user_agent_string, device_info)
+        return proxy_iframe_playlist(post_id, iframe_source, headers, content_host)
+
+    cached = STREAM_CACHE.get((post_id, video_path), wait=CACHE_WAIT_SECONDS) if not byte_range else None
+    if cached is not None:
         if '.m3u8' in video_path:
-            logging.info("Playlist found. Rewriting URLs...")
-            original_content = response.text
-
-            base_path = os.path.dirname(video_path.lstrip('/'))
-            if base_path:
-                proxy_prefix = f"/stream/p{post_id}/{base_path}/"
-            else:
-                proxy_prefix = f"/stream/p{post_id}/"
-
-            proxy_prefix = re.sub(r'/+', '/', proxy_prefix)
-            replacement_string = f"{proxy_prefix}\\1"
-
-            rewritten_content = re.sub(
-                r'^(?!#)(.*)',
-                replacement_string,
-                original_content,
-                flags=re.MULTILINE
+            rewritten_content = rewrite_playlist(
+                cached.content.decode('utf-8'), post_id, video_path, rendition_policy, segment_group, iframe_playlists
             )
+            return Response(rewritten_content, content_type='application/vnd.apple.mpegurl')
+        return Response(
+            LIVE.track("stream_bodies", StreamBody(
+                _relay_cached(cached.content, index_key=(post_id, video_path) if iframe_playlists else None),
+                expected_length=len(cached.content),
+                tab_id=tab_id,
+                user_id=user_id
+            )),
+            content_type=cached.content_type
+        )
+
+    headers = build_upstream_headers(stream_credentials, content_host, user_agent_string, device_info)
+    if byte_range and '.m3u8' not in video_path:
+        headers["Range"] = byte_range
+
+    if '.m3u8' in video_path:
+        logging.debug("Requesting playlist. Using Cookie: %.80s...", headers['Cookie'])
+
+    ticket = SCHEDULER.admit(priority)
+    try:
+        response = UPSTREAM.get(real_url, headers=headers, stream=True)
+
+        if '.m3u8' in video_path:
+            logging.debug("Playlist found. Rewriting URLs...")
+            try:
+                if segment_group > 1:
+                    # Virtual segment requests look their upstream segments up in this playlist
+                    STREAM_CACHE.put((post_id, video_path), response.content, 'application/vnd.apple.mpegurl',
+                                     ttl=PLAYLIST_TTL)
+                rewritten_content = rewrite_playlist(
+                    response.text, post_id, video_path, rendition_policy, segment_group, iframe_playlists
+                )
+            finally:
+                ticket.release()
 
             return Response(rewritten_content, content_type='application/vnd.apple.mpegurl')
         else:
-            # Stream video segments (.ts), keys, etc.
+            # Stream video segments (.ts), keys, etc. The body is relayed without decoding,
+            # so Content-Length and Content-Range stay those of the bytes sent
+            passthrough_headers = {
+                name: response.headers[name]
+                for name in ('Content-Encoding', 'Content-Range', 'Content-Length', 'Accept-Ranges')
+                if name in response.headers
+            }
+            encoded = 'Content-Encoding' in response.headers
             return Response(
-                response.iter_content(chunk_size=8192),
+                LIVE.track("stream_bodies", StreamBody(
+                    _relay(response, ticket,
+                           index_key=(post_id, video_path)
+                           if iframe_playlists and response.status_code == 200 and not encoded else None),
+                    cleanup=(response.close, ticket.release),
+                    expected_length=int(response.headers.get('Content-Length') or 0),
+                    tab_id=tab_id,
+                    user_id=user_id
+                )),
                 content_type=response.headers.get('Content-Type', 'application/octet-stream'),
-                status=response.status_code
+                status=response.status_code,
+                headers=passthrough_headers
             )
 
     except requests.RequestException as e:
+        ticket.release()
         # Re-raise the exception so it can be caught by the Flask route
-        logging.error(f"Error in proxy_stream_request for {video_path}: {e}")
-        raise e
\ No newline at end of file
+        logging.error("Error in proxy_stream_request for %s: %s", video_path, e)
+        raise e
+    except Exception:
+        ticket.release()
+        raise
+
+
+def _warm_fetch(post_id, video_path, headers, content_host):
+    """
+    Fetches one resource into the stream cache at prefetch priority.
+
+    Returns:
+        bytes or None: the body, or None if it was already cached, in flight or failed.
+    """
+    key = (post_id, video_path)
+    if not STREAM_CACHE.begin(key):
+        return None
+    ticket = None
+    try:
+        ticket = SCHEDULER.admit(PRIORITY_PREFETCH)
+        response = UPSTREAM.get(f"https://{content_host}/{video_path}", headers=headers, stream=False)
+        STREAM_CACHE.put(key, response.content, response.headers.get('Content-Type', 'application/octet-stream'))
+        METRICS.incr("warm.fetched")
+        return response.content
+    except Exception as e:
+        logging.warning("Warm-up fetch of %s failed: %s", video_path, e)
+        METRICS.incr("warm.failed")
+        STREAM_CACHE.abandon(key)
+        return None
+    finally:
+        if ticket is not None:
+            ticket.release()
+
+
+def _resolve_uri(playlist_path, uri):
+    """Resolves a playlist URI to a content host path, None for absolute URLs."""
+    if not uri or urlsplit(uri).scheme:
+        return None
+    return posixpath.normpath(posixpath.join(posixpath.dirname(playlist_path), uri)).lstrip('/')
+
+
+def _warm_stream_path(post_id, master_path, headers, content_host, rendition_policy):
+    master = _warm_fetch(post_id, master_path, headers, content_host)
+    if master is None:
+        return
+    master = master.decode('utf-8')
+
+    media_path = master_path
+    if is_master_playlist(master):
+        # The variant the player will load first, i.e. the first one left by the policy
+        variants = [item for item in parse_master_playlist(master) if isinstance(item, Variant)]
+        selected = select_variants(variants, rendition_policy)
+        media_path = _resolve_uri(master_path, selected[0].uri) if selected else None
+        if not media_path:
+            return
+        media = _warm_fetch(post_id, media_path, headers, content_host)
+        if media is None:
+            return
+        media = media.decode('utf-8')
+    else:
+        media = master
+
+    segment_uris = [line for line in media.splitlines() if line and not line.startswith('#')]
+    for uri in segment_uris[:WARM_SEGMENTS]:
+        segment_path = _resolve_uri(media_path, uri)
+        if segment_path:
+            _warm_executor.submit(_warm_fetch, post_id, segment_path, headers, content_host)
+
+
+def warm_stream_path(post_id, master_url, stream_credentials, content_host, user_agent_string, device_info,
+                     rendition_policy=NO_POLICY):
+    """
+    Starts fetching, in the background, what the player will ask for first: the master
+    playlist, the first variant's media playlist and its first segments.
+    The player requests then hit the stream cache (or wait for the fetch in flight).
+
+    Args:
+        post_id (int): The post_id.
+        master_url (str): The playlist URL handed to the player.
+        stream_credentials (dict): A dict with 'CloudFront-Key-Pair-Id', 'CloudFront-Signature', 'CloudFront-Policy'.
+        content_host (str): The hostname of the content server.
+        user_agent_string: The user agent to use
+        device_info(dict): Dictionary of the device info
+        rendition_policy (RenditionPolicy): The policy the master playlist will be served with.
+    """
+    master_path = urlsplit(master_url).path.lstrip('/')
+    headers = build_upstream_headers(stream_credentials, content_host, user_agent_string, device_info)
+    METRICS.incr("warm.started")
+    _warm_executor.submit(_warm_stream_path, post_id, master_path, headers, content_host, rendition_policy)
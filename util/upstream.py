@@ -0,0 +1,343 @@
+import time
+import random
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from util.metrics import METRICS
+from util.scheduler import SCHEDULER
+
+log = logging.getLogger(__name__)
+
+# Statuses worth another try on an idempotent request
+RETRYABLE_STATUSES = {500, 502, 503, 504}
+
+
+class TtfbTracker:
+    """
+    Keeps a sliding window of time-to-first-byte samples per host and
+    derives the hedge delay and read timeout from its percentiles.
+    """
+
+    def __init__(self, window=200, min_samples=20):
+        self.window = window
+        self.min_samples = min_samples
+        self._samples = {}  # { host: deque of seconds }
+        self._lock = threading.Lock()
+
+    def record(self, host, seconds):
+        with self._lock:
+            samples = self._samples.get(host)
+            if samples is None:
+                samples = self._samples[host] = deque(maxlen=self.window)
+            samples.append(seconds)
+
+    def percentile(self, host, pct):
+        """Returns the pct percentile (0-100) of the host TTFB, or None without enough samples."""
+        with self._lock:
+            samples = self._samples.get(host)
+            if not samples or len(samples) < self.min_samples:
+                return None
+            ordered = sorted(samples)
+        index = min(len(ordered) - 1, int(round(pct / 100.0 * (len(ordered) - 1))))
+        return ordered[index]
+
+    def stats(self):
+        hosts = list(self._samples)
+        return {
+            host: {
+                "samples": len(self._samples[host]),
+                "p50": self.percentile(host, 50),
+                "p95": self.percentile(host, 95),
+                "p99": self.percentile(host, 99),
+            }
+            for host in hosts
+        }
+
+
+class ChunkSizer:
+    """
+    Picks relay read sizes from the observed throughput, so that one chunk takes
+    about target_seconds to arrive: small chunks while the upstream is slow (the
+    client gets bytes as they come), large ones when it is fast (fewer yields and writes).
+    """
+
+    def __init__(self, initial=64 * 1024, minimum=16 * 1024, maximum=1024 * 1024, target_seconds=0.02):
+        self.size = initial
+        self.minimum = minimum
+        self.maximum = maximum
+        self.target_seconds = target_seconds
+        self.rate = None  # bytes/s
+        self._bytes = None  # bytes and seconds per read, exponentially weighted
+        self._seconds = None
+
+    def observe(self, nbytes, seconds):
+        # Bytes and time are averaged separately: averaging per-read rates would let one
+        # read served from the socket buffer pass for a fast upstream for many reads
+        if self._bytes is None:
+            self._bytes, self._seconds = float(nbytes), max(seconds, 0.0)
+        else:
+            self._bytes = 0.7 * self._bytes + 0.3 * nbytes
+            self._seconds = 0.7 * self._seconds + 0.3 * max(seconds, 0.0)
+        if self._seconds <= 0:
+            self.rate = float(self.maximum) / self.target_seconds
+        else:
+            self.rate = self._bytes / self._seconds
+        wanted = self.rate * self.target_seconds
+        # Powers of two between minimum and maximum
+        size = self.minimum
+        while size * 2 <= min(wanted, self.maximum):
+            size *= 2
+        self.size = size
+
+
+class BufferPool:
+    """Free list of equally sized bytearrays, reused across relays instead of reallocated."""
+
+    def __init__(self, size, keep=32):
+        self.size = size
+        self.keep = keep
+        self._free = []
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        with self._lock:
+            if self._free:
+                return self._free.pop()
+        return bytearray(self.size)
+
+    def release(self, buffer):
+        with self._lock:
+            if len(self._free) < self.keep:
+                self._free.append(buffer)
+
+
+RELAY_BUFFERS = BufferPool(ChunkSizer().maximum)
+
+
+def iter_raw_chunks(response, sizer=None, decode_content=True):
+    """
+    Yields the body of a streamed requests response as memoryview slices of a pooled
+    buffer, read straight from the socket with readinto: no urllib3 read buffering,
+    no decoding and no per-chunk allocation. Each slice is only valid until the next
+    one is requested, copy it before keeping it.
+
+    Bodies with a Content-Encoding go through iter_content instead, which decodes
+    them, unless decode_content is False: the encoded bytes are then yielded as
+    received, for a relay that forwards the Content-Encoding header.
+
+    On a complete read the connection is handed back to the pool for reuse.
+    """
+    sizer = sizer or ChunkSizer()
+    raw = response.raw
+    fp = getattr(raw, '_fp', None)  # the http.client response under urllib3
+    if not hasattr(fp, 'readinto'):
+        if decode_content:
+            yield from response.iter_content(chunk_size=sizer.size)
+        else:
+            yield from raw.stream(sizer.size, decode_content=False)
+        return
+    if decode_content and response.headers.get('Content-Encoding'):
+        yield from response.iter_content(chunk_size=sizer.size)
+        return
+
+    buffer = RELAY_BUFFERS.acquire()
+    view = memoryview(buffer)
+    try:
+        # A chunk is timed from the end of the previous read: with the time spent sending
+        # it, buffered data no longer looks like a fast upstream, and one blocking
+        # readinto stays short enough for a disconnected client to be noticed quickly
+        previous = time.monotonic()
+        while True:
+            n = fp.readinto(view[:sizer.size])
+            if not n:
+                break
+            now = time.monotonic()
+            sizer.observe(n, now - previous)
+            previous = now
+            yield view[:n]
+        raw.release_conn()
+    finally:
+        view.release()
+        RELAY_BUFFERS.release(buffer)
+
+
+class UpstreamClient:
+    """
+    Resilient GET client for the content host.
+
+    - a shared connection pool instead of one connection per request
+    - connect/read timeouts, the read timeout adapting to the observed TTFB
+    - a hedged duplicate request when the first one is slower than the host p95 TTFB,
+      the losing request is closed as soon as a winner is known. Hedged requests run
+      on a pool of hedge_workers threads, never queued: when no worker is free the
+      request is sent unhedged on the caller's thread, so time spent waiting for the
+      pool is neither counted as upstream latency nor a hidden concurrency cap
+    - retries with jittered exponential backoff on connection errors and 5xx
+    """
+
+    def __init__(
+        self,
+        connect_timeout=3.05,
+        min_read_timeout=2.0,
+        max_read_timeout=20.0,
+        hedge_percentile=95,
+        min_hedge_delay=0.05,
+        max_hedge_delay=2.0,
+        max_attempts=3,
+        backoff_base=0.2,
+        backoff_cap=2.0,
+        pool_size=32,
+        hedge_workers=16
+    ):
+        self.connect_timeout = connect_timeout
+        self.min_read_timeout = min_read_timeout
+        self.max_read_timeout = max_read_timeout
+        self.hedge_percentile = hedge_percentile
+        self.min_hedge_delay = min_hedge_delay
+        self.max_hedge_delay = max_hedge_delay
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_cap = backoff_cap
+
+        self.ttfb = TtfbTracker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=8, pool_maxsize=pool_size)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._executor = ThreadPoolExecutor(max_workers=hedge_workers, thread_name_prefix="upstream")
+        self._free_workers = threading.Semaphore(hedge_workers)
+
+    def read_timeout(self, host):
+        p99 = self.ttfb.percentile(host, 99)
+        if p99 is None:
+            return self.max_read_timeout
+        return min(self.max_read_timeout, max(self.min_read_timeout, p99 * 4))
+
+    def hedge_delay(self, host):
+        threshold = self.ttfb.percentile(host, self.hedge_percentile)
+        if threshold is None:
+            return None  # Not enough data to know what "slow" means yet
+        return min(self.max_hedge_delay, max(self.min_hedge_delay, threshold))
+
+    def _send(self, url, headers, host, stream):
+        response = self.session.get(
+            url,
+            headers=headers,
+            stream=stream,
+            timeout=(self.connect_timeout, self.read_timeout(host))
+        )
+        # requests measures elapsed up to the parsed headers, before reading the body
+        # even with stream=False, so whole-body fetches do not inflate the TTFB percentiles
+        self.ttfb.record(host, response.elapsed.total_seconds())
+        return response
+
+    def _submit(self, url, headers, host, stream):
+        """Starts a request on a free pool worker, or returns None if every worker is busy."""
+        if not self._free_workers.acquire(blocking=False):
+            return None
+
+        def send():
+            try:
+                return self._send(url, headers, host, stream)
+            finally:
+                self._free_workers.release()
+        return self._executor.submit(send)
+
+    def _send_hedged(self, url, headers, host, stream):
+        delay = self.hedge_delay(host)
+        if delay is None:
+            return self._send(url, headers, host, stream)
+
+        primary = self._submit(url, headers, host, stream)
+        if primary is None:
+            METRICS.incr("upstream.hedges_unavailable")
+            return self._send(url, headers, host, stream)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+
+        hedge = self._submit(url, headers, host, stream)
+        if hedge is None:
+            METRICS.incr("upstream.hedges_unavailable")
+            return primary.result()
+        METRICS.incr("upstream.hedges")
+        pending = {primary, hedge}
+        error = None
+        while pending:
+            done, pending = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                try:
+                    response = future.result()
+                except requests.RequestException as e:
+                    error = e
+                    continue
+                if future is hedge:
+                    METRICS.incr("upstream.hedge_wins")
+                for loser in pending:
+                    self._cancel(loser)
+                return response
+        raise error
+
+    @staticmethod
+    def _cancel(future):
+        """Drops a losing request: never started, or closed once it returns."""
+        if future.cancel():
+            return
+        METRICS.incr("upstream.hedges_cancelled")
+
+        def close(f):
+            if not f.exception():
+                f.result().close()
+        future.add_done_callback(close)
+
+    def _backoff(self, attempt):
+        # "Full jitter": uniform in [0, min(cap, base * 2^attempt)]
+        return random.uniform(0, min(self.backoff_cap, self.backoff_base * (2 ** attempt)))
+
+    def get(self, url, headers, stream=True):
+        """
+        GETs an upstream resource with hedging and retries.
+
+        Args:
+            url (str): The full URL.
+            headers (dict): The request headers.
+            stream (bool): Whether to defer downloading the body.
+        Returns:
+            requests.Response: The response, with raise_for_status() already checked.
+        """
+        host = urlsplit(url).hostname
+        METRICS.incr("upstream.requests")
+        for attempt in range(self.max_attempts):
+            if attempt:
+                METRICS.incr("upstream.retries")
+                time.sleep(self._backoff(attempt))
+            try:
+                response = self._send_hedged(url, headers, host, stream)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                if attempt == self.max_attempts - 1:
+                    METRICS.incr("upstream.failures")
+                    raise
+                log.warning("Upstream attempt %d for %s failed: %s", attempt + 1, url, e)
+                continue
+
+            if response.status_code in RETRYABLE_STATUSES and attempt < self.max_attempts - 1:
+                log.warning("Upstream attempt %d for %s returned %s", attempt + 1, url, response.status_code)
+                response.close()
+                continue
+
+            if response.status_code >= 400:
+                METRICS.incr("upstream.failures")
+                response.close()
+            response.raise_for_status()
+            return response
+
+
+# A primary and a hedge for each admitted transfer, and for the pipelined fetches of virtual segments
+UPSTREAM = UpstreamClient(hedge_workers=4 * SCHEDULER.max_transfers)
+METRICS.register_provider("upstream_ttfb", UPSTREAM.ttfb.stats)